@@ -0,0 +1,91 @@
+"""
+Бэктест правил предупреждений на записанных ответах или истории из SQLite.
+
+Примеры:
+    python backtest.py --recording records.jsonl.gz --drop 10,15,20 --current 9,5
+    python backtest.py --database database/events.db --z 2 --alerts
+    python backtest.py --recording records.jsonl.gz --rules alert_rules.json
+"""
+import time
+import argparse
+from itertools import product
+from typing import List, Optional
+
+from calculate import (DROP_THRESHOLD,
+                       CURRENT_THRESHOLD,
+                       RuleSettings,
+                       load_rules,
+                       load_recording,
+                       load_event_results,
+                       replay)
+
+
+def parse_floats(value: str) -> List[Optional[float]]:
+    return [None if item == 'none' else float(item) for item in value.split(',')]
+
+
+def print_alerts(report) -> None:
+    for alert in report.alerts:
+        print(f"    {alert.time} {alert.kind:<12} {alert.site_name} "
+              f"{alert.percentage:.0f}% (average {alert.average:.0f}%, drop {alert.drop:.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--recording', help='Файл ResponseRecorder (.jsonl или .jsonl.gz)')
+    source.add_argument('--database', help='База SQLite с таблицей event_results')
+    parser.add_argument('--drop', default=str(DROP_THRESHOLD), help='Пороги падения через запятую')
+    parser.add_argument('--current', default=str(CURRENT_THRESHOLD), help='Пороги текущего процента через запятую')
+    parser.add_argument('--z', default='none', help='Пороги z-оценки через запятую; none - без z-оценки')
+    parser.add_argument('--window', default='10', help='Размеры окна истории через запятую')
+    parser.add_argument('--rules', nargs='+', help='Файлы правил (calculate/rules.py) вместо порогов')
+    parser.add_argument('--alerts', action='store_true', help='Вывести все предупреждения')
+    args = parser.parse_args()
+    # Ошибка в пути или описании правил видна до долгой загрузки данных
+    engines = []
+    try:
+        engines = [(path, load_rules(path)) for path in args.rules or ()]
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    started = time.perf_counter()
+    # Данные читаются один раз и прогоняются через все варианты правил
+    if args.recording:
+        cycles = list(load_recording(args.recording))
+    else:
+        cycles = list(load_event_results(args.database))
+    loaded = time.perf_counter()
+    print(f"Loaded {len(cycles)} cycles, {sum(len(samples) for _, samples in cycles)} samples "
+          f"in {loaded - started:.2f}s")
+
+    if args.rules:
+        for path, rules in engines:
+            replay_started = time.perf_counter()
+            report = replay(cycles, RuleSettings(window=int(args.window.split(',')[0])), rules=rules)
+            counts = ', '.join(f"{name}={count}" for name, count in sorted(report.counts().items()))
+            print(f"{path}: {counts or 'no alerts'} ({time.perf_counter() - replay_started:.2f}s)")
+            if args.alerts:
+                print_alerts(report)
+        return
+
+    print(f"{'drop':>6} {'current':>8} {'z':>6} {'window':>7} {'warnings':>9} {'available':>10} {'time,s':>7}")
+    for drop, current, z, window in product(parse_floats(args.drop),
+                                            parse_floats(args.current),
+                                            parse_floats(args.z),
+                                            parse_floats(args.window)):
+        settings = RuleSettings(drop_threshold=drop,
+                                current_threshold=current,
+                                z_threshold=z,
+                                window=int(window))
+        replay_started = time.perf_counter()
+        report = replay(cycles, settings)
+        print(f"{drop:>6g} {current:>8g} {z if z is not None else '-':>6} {int(window):>7} "
+              f"{report.warnings_count:>9} {report.available_count:>10} "
+              f"{time.perf_counter() - replay_started:>7.2f}")
+        if args.alerts:
+            print_alerts(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Один прогон бенчмарка: полные циклы проверки N сайтов против заглушек из fake_api.
+
+Печатает результат в JSON. Обычно запускается из benchmarks.run, по
+отдельному процессу на каждый размер, чтобы пиковый RSS не смешивался.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+
+def configure_environment(api_address: str) -> None:
+    # Модули бота читают настройки при импорте, поэтому окружение задается до него
+    os.environ['DOMAIN'] = api_address
+    os.environ['TELEGRAM_API_SERVER'] = f"http://{api_address}"
+    os.environ.setdefault('TELEGRAM_BOT_API_TOKEN', '123456:benchmark')
+    os.environ.setdefault('TELEGRAM_CHANNEL_INFO', '-1001')
+    os.environ.setdefault('TELEGRAM_CHANNEL_WARNING', '-1002')
+    os.environ.setdefault('API_ID', '1')
+    # Ошибки заглушек не должны попадать в рабочий лог бота
+    os.environ['LOG_FILE'] = os.path.join(tempfile.mkdtemp(prefix='bench-log-'), 'checkevents.log')
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(np.asarray(values), [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+async def run(args) -> dict:
+    import main
+    import httpx
+    from request.requests import get_client
+    from database import SQLiteStore, HistoryCache
+    from logger import EventMessage, metrics
+    from request import PollScheduler
+    from telegram import telegram_bot
+    from telegram.dispatcher import MessageDispatcher
+
+    # Лимиты Telegram растянули бы цикл на десятки минут и измеряли бы их, а не код
+    telegram_bot.message_queue = MessageDispatcher(telegram_bot._execute,
+                                                   global_rate=1e6, global_capacity=1e6,
+                                                   chat_rate=1e6, chat_capacity=1e6)
+    # Telethon работает по MTProto, для него заглушки нет; удаления только считаются
+    telethon_calls = Counter()
+
+    async def delete_messages(chat_id, limit=None):
+        telethon_calls['delete_messages'] += 1
+
+    async def delete_messages_by_id(chat_id, message_ids):
+        telethon_calls['delete_messages_by_id'] += 1
+
+    telegram_bot.tg_delete_messages = delete_messages
+    telegram_bot.tg_delete_messages_by_id = delete_messages_by_id
+
+    latencies = []
+    started_at = {}
+
+    async def on_request(request: httpx.Request):
+        started_at[id(request)] = time.perf_counter()
+
+    async def on_response(response: httpx.Response):
+        started = started_at.pop(id(response.request), None)
+        if started is not None:
+            latencies.append(time.perf_counter() - started)
+
+    client = get_client()
+    client.event_hooks = {'request': [on_request], 'response': [on_response]}
+
+    database = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'events.db')
+    store = SQLiteStore(database=database)
+    await store.init_db()
+    save_results = store.save_results
+    db_time = [0.0]
+
+    async def timed_save_results(results):
+        started = time.perf_counter()
+        await save_results(results)
+        db_time[0] += time.perf_counter() - started
+
+    store.save_results = timed_save_results
+
+    site_names = [f"site-{index}" for index in range(args.sites)]
+    history = HistoryCache(limit=main.HISTORY_LIMIT)
+    scheduler = PollScheduler(base_interval=main.CHECK_INTERVAL,
+                              min_interval=main.MIN_CHECK_INTERVAL,
+                              max_interval=main.MAX_CHECK_INTERVAL)
+    message_for_tg = EventMessage()
+    message_parts = []
+    cycles = []
+    try:
+        for cycle in range(args.cycles):
+            latencies.clear()
+            db_time[0] = 0.0
+            metrics.start_cycle()
+            started = time.perf_counter()
+            await history.sync(store, site_names)
+            scheduler.sync(site_names)
+            summary_changed = await main.check_sites(site_names, history, store, scheduler, message_for_tg)
+            checked = time.perf_counter()
+            if summary_changed or not message_parts:
+                message_parts = await main.update_summary(message_for_tg, message_parts)
+            finished = time.perf_counter()
+            cycles.append({'cycle': cycle,
+                           'wall_time': finished - started,
+                           'check_time': checked - started,
+                           'summary_time': finished - checked,
+                           'db_write_time': db_time[0],
+                           'requests': len(latencies),
+                           'latency': percentiles(latencies),
+                           'summary_parts': len(message_parts),
+                           'stages': metrics.finish_cycle(sites=len(site_names))})
+    finally:
+        await main.close_client()
+        await telegram_bot.close()
+        await store.close()
+
+    async with httpx.AsyncClient() as stats_client:
+        stats = (await stats_client.get(f"http://{args.api}/stats")).json()
+    return {'sites': args.sites,
+            'cycles': cycles,
+            # ru_maxrss в Linux - килобайты
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'telegram_calls': sum(stats['telegram_calls'].values()) + sum(telethon_calls.values()),
+            'telegram_calls_by_method': {**stats['telegram_calls'], **telethon_calls},
+            'ticket_requests': stats['ticket_requests']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sites', type=int, required=True)
+    parser.add_argument('--cycles', type=int, default=2)
+    parser.add_argument('--api', default='127.0.0.1:8090', help='Адрес benchmarks.fake_api')
+    args = parser.parse_args()
+    configure_environment(args.api)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    print(json.dumps(asyncio.run(run(args))))
+
+
+if __name__ == '__main__':
+    main()
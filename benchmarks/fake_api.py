@@ -0,0 +1,127 @@
+"""
+Локальные заглушки API проверки билетов и Telegram Bot API для бенчмарков.
+
+Запуск: python -m benchmarks.fake_api --port 8090 --latency 0.05 --error-rate 0.01
+"""
+import time
+import json
+import random
+import asyncio
+import argparse
+from collections import Counter
+from hashlib import blake2b
+
+from aiohttp import web
+
+
+class FakeTicketAPI:
+    """
+    Отвечает на react_api/v1/check_ticket_availability.
+
+    Доля сайтов change_rate меняет счетчики при каждом запросе, остальные
+    отвечают одним и тем же телом и поддерживают ETag/If-None-Match.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.5, error_rate=0.0, change_rate=0.1, seed=0):
+        """
+        :param latency: Средняя задержка ответа в секундах
+        :param jitter: Разброс задержки (доля от latency)
+        :param error_rate: Доля ответов 503
+        :param change_rate: Доля сайтов, данные которых меняются между проверками
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.change_rate = change_rate
+        self.random = random.Random(seed)
+        self.versions = Counter()
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        site_name = request.query.get('site-name', '')
+        delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+        await asyncio.sleep(max(delay, 0.0))
+        if self.random.random() < self.error_rate:
+            return web.Response(status=503)
+
+        seed = int.from_bytes(blake2b(site_name.encode(), digest_size=8).digest(), 'big')
+        if (seed % 1000) / 1000 < self.change_rate:
+            self.versions[site_name] += 1
+        site_random = random.Random(seed + self.versions[site_name])
+        total = site_random.randint(1, 200)
+        with_tickets = site_random.randint(0, total)
+        body = json.dumps({'total_events_count': total,
+                           'events_with_tickets_count': with_tickets,
+                           'events_without_tickets_count': total - with_tickets}).encode()
+        etag = f'"{blake2b(body, digest_size=8).hexdigest()}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='application/json', headers={'ETag': etag})
+
+
+class FakeBotAPI:
+    """Принимает вызовы Bot API и считает их по методам."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.message_id = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        data = await request.post()
+        if method in ('sendMessage', 'editMessageText'):
+            if method == 'sendMessage':
+                self.message_id += 1
+                message_id = self.message_id
+            else:
+                message_id = int(data.get('message_id', 0))
+            result = {'message_id': message_id,
+                      'date': int(time.time()),
+                      'chat': {'id': int(data.get('chat_id', 0)), 'type': 'channel'},
+                      'text': data.get('text', '')}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+def create_app(ticket_api: FakeTicketAPI, bot_api: FakeBotAPI) -> web.Application:
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response({'ticket_requests': ticket_api.requests,
+                                  'telegram_calls': dict(bot_api.calls)})
+
+    async def reset(request: web.Request) -> web.Response:
+        ticket_api.requests = 0
+        ticket_api.versions.clear()
+        bot_api.calls.clear()
+        return web.json_response({'ok': True})
+
+    app = web.Application()
+    app.router.add_get('/react_api/v1/check_ticket_availability', ticket_api.handle)
+    app.router.add_post('/bot{token}/{method}', bot_api.handle)
+    app.router.add_get('/stats', stats)
+    app.router.add_post('/reset', reset)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--change-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    ticket_api = FakeTicketAPI(latency=args.latency,
+                               jitter=args.jitter,
+                               error_rate=args.error_rate,
+                               change_rate=args.change_rate,
+                               seed=args.seed)
+    web.run_app(create_app(ticket_api, FakeBotAPI()), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
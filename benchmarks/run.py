@@ -0,0 +1,154 @@
+"""
+Бенчмарк полного цикла проверки на 100, 1k, 10k и 50k сайтов.
+
+Запускает заглушки API и Telegram, прогоняет benchmarks.cycle для каждого
+размера в отдельном процессе, сохраняет результаты в benchmarks/results
+и сравнивает их с предыдущим прогоном. Каталог results в git не хранится:
+результаты зависят от машины и сравниваются только локально.
+
+Запуск: python -m benchmarks.run --sizes 100,1000 --latency 0.02 --error-rate 0.01
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+from typing import List, Optional
+
+import httpx
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = '100,1000,10000,50000'
+# Метрики, рост которых больше порога считается регрессией
+COMPARED_METRICS = ('wall_time', 'db_write_time', 'latency_p95', 'peak_rss_mb', 'telegram_calls')
+
+
+def start_fake_api(args) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_api',
+                                '--port', str(args.port),
+                                '--latency', str(args.latency),
+                                '--error-rate', str(args.error_rate),
+                                '--change-rate', str(args.change_rate)],
+                               cwd=ROOT_DIR)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.port}/stats")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Fake API did not start")
+
+
+def run_size(args, sites: int) -> dict:
+    httpx.post(f"http://127.0.0.1:{args.port}/reset")
+    completed = subprocess.run([sys.executable, '-m', 'benchmarks.cycle',
+                                '--sites', str(sites),
+                                '--cycles', str(args.cycles),
+                                '--api', f"127.0.0.1:{args.port}"],
+                               cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(result: dict) -> dict:
+    """Метрики прогона для сравнения: по последнему (прогретому) циклу."""
+    cycle = result['cycles'][-1]
+    return {'wall_time': cycle['wall_time'],
+            'db_write_time': cycle['db_write_time'],
+            'latency_p50': cycle['latency']['p50'],
+            'latency_p95': cycle['latency']['p95'],
+            'latency_p99': cycle['latency']['p99'],
+            'peak_rss_mb': result['peak_rss_mb'],
+            'telegram_calls': result['telegram_calls']}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latest_run(exclude: str) -> Optional[dict]:
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    names = sorted(name for name in os.listdir(RESULTS_DIR) if name.endswith('.json') and name != exclude)
+    if not names:
+        return None
+    with open(os.path.join(RESULTS_DIR, names[-1]), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def compare(current: dict, previous: dict, threshold: float) -> List[str]:
+    regressions = []
+    previous_sizes = {str(run['sites']): summarize(run) for run in previous['runs']}
+    for run in current['runs']:
+        before = previous_sizes.get(str(run['sites']))
+        if before is None:
+            continue
+        after = summarize(run)
+        for metric in COMPARED_METRICS:
+            if before[metric] and after[metric] is not None and after[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{run['sites']} sites: {metric} {before[metric]:.3f} -> {after[metric]:.3f}")
+    return regressions
+
+
+def print_table(runs: List[dict]) -> None:
+    print(f"{'sites':>7} {'wall,s':>8} {'db,s':>7} {'p50,ms':>8} {'p95,ms':>8} {'p99,ms':>8} {'rss,MB':>8} {'tg':>5}")
+    for run in runs:
+        metrics = summarize(run)
+        latency = [(metrics[key] or 0) * 1000 for key in ('latency_p50', 'latency_p95', 'latency_p99')]
+        print(f"{run['sites']:>7} {metrics['wall_time']:>8.2f} {metrics['db_write_time']:>7.3f} "
+              f"{latency[0]:>8.1f} {latency[1]:>8.1f} {latency[2]:>8.1f} "
+              f"{metrics['peak_rss_mb']:>8.1f} {metrics['telegram_calls']:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=DEFAULT_SIZES)
+    parser.add_argument('--cycles', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--change-rate', type=float, default=0.1)
+    parser.add_argument('--threshold', type=float, default=0.1, help='Допустимый рост метрики (доля)')
+    args = parser.parse_args()
+
+    fake_api = start_fake_api(args)
+    try:
+        runs = [run_size(args, int(sites)) for sites in args.sizes.split(',')]
+    finally:
+        fake_api.terminate()
+        fake_api.wait()
+
+    started = datetime.now()
+    report = {'started': started.isoformat(timespec='seconds'),
+              'revision': git_revision(),
+              'params': {key: value for key, value in vars(args).items() if key != 'port'},
+              'runs': runs}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    file_name = f"{started:%Y%m%d-%H%M%S}.json"
+    with open(os.path.join(RESULTS_DIR, file_name), 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+    print_table(runs)
+    previous = latest_run(exclude=file_name)
+    if previous is None:
+        return
+    if previous['params'] != report['params']:
+        print(f"Previous run {previous['started']} used different parameters, not comparing")
+        return
+    regressions = compare(report, previous, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
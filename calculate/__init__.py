@@ -1 +1,5 @@
-from .math import *
\ No newline at end of file
+from .math import *
+from .batch import *
+from .cycle import *
+from .replay import *
+from .rules import *
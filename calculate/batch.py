@@ -0,0 +1,260 @@
+from collections import namedtuple
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+__all__ = ['DROP_THRESHOLD', 'CURRENT_THRESHOLD', 'BatchEvaluation', 'HistorySummary', 'HistoryBuffer',
+           'calculate_percentages', 'stack_history', 'evaluate_batch']
+
+DROP_THRESHOLD = 10
+CURRENT_THRESHOLD = 9
+
+# baselines - долгосрочный средний процент по агрегатам истории, NaN - агрегатов нет
+BatchEvaluation = namedtuple('BatchEvaluation', ['percentages', 'averages', 'last_percentages',
+                                                 'drops', 'z_scores', 'has_history',
+                                                 'warning_mask', 'available_mask', 'baselines'])
+# Статистика окна истории до текущей проверки; last_* равны 0, если истории нет
+HistorySummary = namedtuple('HistorySummary', ['averages', 'stds', 'last_percentages',
+                                               'last_with_tickets', 'last_total', 'has_history'])
+
+
+def calculate_percentages(events_with_tickets_count: np.ndarray,
+                          total_events_count: np.ndarray) -> np.ndarray:
+    """
+    Вычисляет процент мероприятий с билетами для массива проверок (как calculate_percentage).
+
+    :param events_with_tickets_count: Массив количества мероприятий с билетами
+    :param total_events_count: Массив общего количества мероприятий
+    :return: Массив процентов, 0 там, где мероприятий нет
+    """
+    events_with_tickets_count = np.asarray(events_with_tickets_count, dtype=np.float64)
+    total_events_count = np.asarray(total_events_count, dtype=np.float64)
+    percentages = np.zeros(np.broadcast(events_with_tickets_count, total_events_count).shape)
+    np.divide(events_with_tickets_count, total_events_count,
+              out=percentages, where=total_events_count > 0)
+    return percentages * 100
+
+
+def stack_history(histories: Sequence[Optional[Sequence[Tuple[int, int]]]],
+                  window: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Собирает историю всех сайтов в матрицы фиксированной ширины.
+
+    :param histories: Для каждого сайта список (events_with_tickets_count, total_events_count)
+                      от новых к старым или None, если истории нет
+    :param window: Ширина окна истории
+    :return: (history_with_tickets, history_total, history_length); матрицы формы (n, window),
+             столбец 0 - последняя проверка
+    """
+    histories = [history[:window] if history else () for history in histories]
+    sites_count = len(histories)
+    history_length = np.fromiter(map(len, histories), dtype=np.int64, count=sites_count)
+    history_with_tickets = np.zeros((sites_count, window), dtype=np.int64)
+    history_total = np.zeros((sites_count, window), dtype=np.int64)
+
+    samples_count = int(history_length.sum())
+    if samples_count:
+        flat = np.fromiter(chain.from_iterable(chain.from_iterable(histories)),
+                           dtype=np.int64, count=samples_count * 2).reshape(-1, 2)
+        rows = np.repeat(np.arange(sites_count), history_length)
+        offsets = np.repeat(np.cumsum(history_length) - history_length, history_length)
+        columns = np.arange(samples_count) - offsets
+        history_with_tickets[rows, columns] = flat[:, 0]
+        history_total[rows, columns] = flat[:, 1]
+    return history_with_tickets, history_total, history_length
+
+
+def _window_statistics(history_with_tickets: np.ndarray,
+                       history_total: np.ndarray,
+                       history_length: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """:return: (history_percentages, averages, stds, has_history) по заполненным столбцам окна"""
+    history_length = np.asarray(history_length)
+    history_percentages = calculate_percentages(history_with_tickets, history_total)
+    valid = np.arange(history_percentages.shape[1]) < history_length[:, None]
+    counts = np.maximum(history_length, 1)
+
+    masked = np.where(valid, history_percentages, 0.0)
+    averages = masked.sum(axis=1) / counts
+    variances = np.maximum((masked * masked).sum(axis=1) / counts - averages * averages, 0.0)
+    return history_percentages, averages, np.sqrt(variances), history_length > 0
+
+
+def evaluate_batch(events_with_tickets_count: np.ndarray,
+                   total_events_count: np.ndarray,
+                   history_with_tickets: np.ndarray,
+                   history_total: np.ndarray,
+                   history_length: np.ndarray,
+                   drop_threshold: float = DROP_THRESHOLD,
+                   current_threshold: float = CURRENT_THRESHOLD,
+                   z_threshold: Optional[float] = None,
+                   baselines: Optional[np.ndarray] = None) -> BatchEvaluation:
+    """
+    Проверяет все сайты цикла за один векторизованный проход.
+
+    Повторяет логику проверок из main.scheduled_check: предупреждение о падении,
+    если процент упал больше чем на drop_threshold относительно среднего за окно,
+    стал меньше current_threshold и на последней проверке билеты были;
+    уведомление о появлении билетов, если на последней проверке их не было.
+
+    :param events_with_tickets_count: Текущее количество мероприятий с билетами, форма (n,)
+    :param total_events_count: Текущее общее количество мероприятий, форма (n,)
+    :param history_with_tickets: История мероприятий с билетами, форма (n, window)
+    :param history_total: История общего количества мероприятий, форма (n, window)
+    :param history_length: Количество заполненных столбцов истории для каждого сайта, форма (n,)
+    :param drop_threshold: Порог падения процента для предупреждения
+    :param current_threshold: Текущий процент, ниже которого падение считается опасным
+    :param z_threshold: Если задан, дополнительно требует z-оценку не выше -z_threshold
+    :param baselines: Долгосрочный базовый процент сайтов (NaN - нет агрегатов), форма (n,); None - нет ни у кого
+    :return: BatchEvaluation с массивами метрик и масками сайтов для уведомлений
+    """
+    percentages = calculate_percentages(events_with_tickets_count, total_events_count)
+    history_percentages, averages, stds, has_history = _window_statistics(history_with_tickets,
+                                                                          history_total,
+                                                                          history_length)
+    window = history_percentages.shape[1]
+
+    drops = averages - percentages
+    z_scores = np.zeros_like(percentages)
+    np.divide(percentages - averages, stds, out=z_scores, where=stds > 0)
+
+    if window:
+        last_percentages = np.where(has_history, history_percentages[:, 0], 0.0)
+        last_available = has_history & (np.asarray(history_with_tickets)[:, 0] > 0)
+    else:
+        last_percentages = np.zeros_like(percentages)
+        last_available = np.zeros_like(has_history)
+
+    warning_mask = (has_history &
+                    (drops > drop_threshold) &
+                    (percentages < current_threshold) &
+                    last_available)
+    if z_threshold is not None:
+        warning_mask &= z_scores <= -z_threshold
+    available_mask = has_history & (percentages > 0) & ~last_available
+
+    return BatchEvaluation(percentages=percentages,
+                           averages=averages,
+                           last_percentages=last_percentages,
+                           drops=drops,
+                           z_scores=z_scores,
+                           has_history=has_history,
+                           warning_mask=warning_mask,
+                           available_mask=available_mask,
+                           baselines=(np.full(percentages.shape, np.nan) if baselines is None
+                                      else np.asarray(baselines, dtype=np.float64)))
+
+
+class HistoryBuffer:
+    """
+    История проверок всех сайтов в предвыделенных матрицах NumPy.
+
+    Каждому сайту принадлежит строка матриц формы (capacity, window),
+    столбец 0 - последняя проверка, как в stack_history. Проверки порции
+    добавляются одним векторизованным сдвигом строк, а evaluate_batch
+    получает выборку строк без сборки истории в Python. Строки удаленных
+    сайтов переиспользуются, при нехватке матрицы увеличиваются вдвое.
+    """
+
+    def __init__(self, window: int = 10, capacity: int = 1024):
+        self.window = window
+        self.with_tickets = np.zeros((capacity, window), dtype=np.int64)
+        self.total = np.zeros((capacity, window), dtype=np.int64)
+        self.length = np.zeros(capacity, dtype=np.int64)
+        # Долгосрочный базовый процент из агрегатов истории, NaN - неизвестен
+        self.baselines = np.full(capacity, np.nan)
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+
+    def rows(self, site_names: Sequence[str]) -> np.ndarray:
+        """:return: Номера строк сайтов; сайтам без истории выделяются пустые строки"""
+        return np.fromiter(map(self._row, site_names), dtype=np.intp, count=len(site_names))
+
+    def _row(self, site_name: str) -> int:
+        row = self._rows.get(site_name)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._rows)
+                if row == len(self.length):
+                    self._grow()
+            self._rows[site_name] = row
+        return row
+
+    def _grow(self) -> None:
+        capacity = len(self.length) * 2 or 1
+        for name in ('with_tickets', 'total', 'length', 'baselines'):
+            values = getattr(self, name)
+            grown = np.zeros((capacity,) + values.shape[1:], dtype=values.dtype)
+            if name == 'baselines':
+                grown.fill(np.nan)
+            grown[:len(values)] = values
+            setattr(self, name, grown)
+
+    def history(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """:return: (history_with_tickets, history_total, history_length) для evaluate_batch"""
+        return self.with_tickets[rows], self.total[rows], self.length[rows]
+
+    def summary(self, rows: np.ndarray) -> HistorySummary:
+        history_with_tickets, history_total, history_length = self.history(rows)
+        history_percentages, averages, stds, has_history = _window_statistics(history_with_tickets,
+                                                                              history_total,
+                                                                              history_length)
+        if self.window:
+            return HistorySummary(averages, stds,
+                                  np.where(has_history, history_percentages[:, 0], 0.0),
+                                  np.where(has_history, history_with_tickets[:, 0], 0),
+                                  np.where(has_history, history_total[:, 0], 0),
+                                  has_history)
+        zeros = np.zeros(len(rows), dtype=np.int64)
+        return HistorySummary(averages, stds, zeros.astype(np.float64), zeros, zeros, has_history)
+
+    def add(self,
+            rows: np.ndarray,
+            events_with_tickets_count: np.ndarray,
+            total_events_count: np.ndarray) -> None:
+        """
+        Добавляет по одной проверке в строки rows.
+
+        :param rows: Номера строк из rows(); каждый сайт не больше одного раза
+        """
+        if not self.window:
+            return
+        # Правая часть - копия выборки, поэтому сдвиг на месте безопасен
+        self.with_tickets[rows, 1:] = self.with_tickets[rows, :-1]
+        self.with_tickets[rows, 0] = events_with_tickets_count
+        self.total[rows, 1:] = self.total[rows, :-1]
+        self.total[rows, 0] = total_events_count
+        self.length[rows] = np.minimum(self.length[rows] + 1, self.window)
+
+    def load(self, site_names: Sequence[str],
+             histories: Sequence[Optional[Sequence[Tuple[int, int]]]]) -> None:
+        """
+        Заменяет историю сайтов загруженной из базы.
+
+        :param histories: Для каждого сайта список (events_with_tickets_count, total_events_count)
+                          от новых к старым или None
+        """
+        rows = self.rows(site_names)
+        self.with_tickets[rows], self.total[rows], self.length[rows] = stack_history(histories, self.window)
+
+    def set_baselines(self, site_names: Sequence[str], baselines: Sequence[float]) -> None:
+        self.baselines[self.rows(site_names)] = baselines
+
+    def remove(self, site_names: Iterable[str]) -> None:
+        for site_name in site_names:
+            row = self._rows.pop(site_name, None)
+            if row is not None:
+                self.length[row] = 0
+                self.baselines[row] = np.nan
+                self._free.append(row)
+
+    def site_names(self) -> List[str]:
+        return list(self._rows)
+
+    def __contains__(self, site_name: str) -> bool:
+        return site_name in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
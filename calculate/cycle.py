@@ -0,0 +1,97 @@
+import sys
+from array import array
+from itertools import compress, repeat
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+__all__ = ['CycleResults']
+
+
+class CycleResults:
+    """
+    Результаты порции проверок в столбцах.
+
+    Вместо кортежа на каждый сайт хранит список интернированных имен и
+    массивы array('q') со счетчиками, которые заполняются по мере прихода
+    ответов. Анализ читает столбцы как массивы NumPy без копирования,
+    сохранение в базу получает строки генератором, а после обработки
+    контейнер очищается и переиспользуется в следующей порции.
+    """
+
+    __slots__ = ('site_names', 'total_events_count', 'events_with_tickets_count',
+                 'events_without_tickets_count', 'changed')
+
+    def __init__(self):
+        self.site_names: List[str] = []
+        self.total_events_count = array('q')
+        self.events_with_tickets_count = array('q')
+        self.events_without_tickets_count = array('q')
+        self.changed = bytearray()
+
+    def append(self,
+               site_name: str,
+               total_events_count: int,
+               events_with_tickets_count: int,
+               events_without_tickets_count: int,
+               changed: bool = True) -> None:
+        self.site_names.append(sys.intern(site_name))
+        self.total_events_count.append(total_events_count)
+        self.events_with_tickets_count.append(events_with_tickets_count)
+        self.events_without_tickets_count.append(events_without_tickets_count)
+        self.changed.append(changed)
+
+    def take(self, indices: Sequence[int]) -> 'CycleResults':
+        """:return: Новый контейнер с выбранными строками"""
+        subset = CycleResults()
+        subset.site_names = [self.site_names[index] for index in indices]
+        for column in ('total_events_count', 'events_with_tickets_count', 'events_without_tickets_count'):
+            values = getattr(self, column)
+            getattr(subset, column).extend(values[index] for index in indices)
+        subset.changed = bytearray(self.changed[index] for index in indices)
+        return subset
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Столбец счетчиков как массив NumPy без копирования.
+
+        Массив ссылается на буфер контейнера: пока он жив, контейнер нельзя
+        пополнять. clear() в этом случае отдает старый буфер массиву и
+        заводит новый.
+        """
+        return np.frombuffer(getattr(self, name), dtype=np.int64)
+
+    def records(self, check_time, changed=True) -> Iterator[Tuple[str, int, int, int, object]]:
+        """
+        Строки для event_results: (url, total, with_tickets, without_tickets, check_time).
+
+        :param changed: True - только изменившиеся проверки, False - только неизменившиеся
+        """
+        rows = zip(self.site_names,
+                   self.total_events_count,
+                   self.events_with_tickets_count,
+                   self.events_without_tickets_count,
+                   repeat(check_time))
+        selectors = self.changed if changed else (not flag for flag in self.changed)
+        return compress(rows, selectors)
+
+    def clear(self) -> None:
+        self.site_names.clear()
+        for column in ('total_events_count', 'events_with_tickets_count', 'events_without_tickets_count'):
+            try:
+                del getattr(self, column)[:]
+            except BufferError:
+                # Столбец еще читает массив из column(), например из traceback упавшей обработки
+                setattr(self, column, array('q'))
+        self.changed.clear()
+
+    def __iter__(self) -> Iterator[Tuple[str, int, int, int, bool]]:
+        """Строки в формате _handle_event_data: (site_name, total, with_tickets, without_tickets, changed)."""
+        return zip(self.site_names,
+                   self.total_events_count,
+                   self.events_with_tickets_count,
+                   self.events_without_tickets_count,
+                   map(bool, self.changed))
+
+    def __len__(self) -> int:
+        return len(self.site_names)
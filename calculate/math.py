@@ -1,5 +1,6 @@
-from typing import List, Tuple
-from collections import namedtuple
+from math import sqrt
+from typing import Deque, Iterable, List, Optional, Tuple
+from collections import deque, namedtuple
 
 def calculate_percentage(event_result: namedtuple) -> float:
     """
@@ -50,4 +51,144 @@ def were_tickets_available(previous_results: List[Tuple[int, int]]) -> bool:
     """
     return any(events_with_tickets_count > 0
                for events_with_tickets_count, total_events_count
-               in previous_results)
\ No newline at end of file
+               in previous_results)
+
+def calculate_baseline_percentage(rollups: Iterable[Tuple[float, float, float, int]]) -> float:
+    """
+    Вычисляет долгосрочный базовый процент мероприятий с билетами по агрегатам истории.
+
+    :param rollups: Почасовые или дневные агрегаты (min_percentage, max_percentage, mean_percentage, sample_count)
+    :return: Средний процент, взвешенный по количеству проверок в каждом агрегате
+    """
+    total_samples = 0
+    weighted_sum = 0.0
+    for min_percentage, max_percentage, mean_percentage, sample_count in rollups:
+        total_samples += sample_count
+        weighted_sum += mean_percentage * sample_count
+    if total_samples > 0:
+        return weighted_sum / total_samples
+    return 0.0
+
+
+class RollingStats:
+    """
+    Скользящая статистика процента мероприятий с билетами для одного сайта.
+
+    Хранит окно последних проверок и обновляет сумму, сумму квадратов,
+    EWMA и счетчик проверок с билетами за O(1) на каждую новую проверку.
+    """
+
+    def __init__(self, window: int = 10, alpha: float = 0.3):
+        """
+        :param window: Размер скользящего окна (количество проверок)
+        :param alpha: Коэффициент сглаживания EWMA
+        """
+        self.window = window
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        # Проверки хранятся от новых к старым, как в get_previous_results
+        self._samples: Deque[Tuple[int, int]] = deque()
+        self._percentages: Deque[float] = deque()
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._available_count = 0
+
+    @classmethod
+    def from_history(cls, previous_results: Iterable[Tuple[int, int]],
+                     window: int = 10, alpha: float = 0.3) -> 'RollingStats':
+        """
+        :param previous_results: Кортежи (events_with_tickets_count, total_events_count), от новых к старым
+        """
+        stats = cls(window=window, alpha=alpha)
+        for events_with_tickets_count, total_events_count in reversed(list(previous_results)):
+            stats.add(events_with_tickets_count, total_events_count)
+        return stats
+
+    def add(self, events_with_tickets_count: int, total_events_count: int) -> float:
+        """
+        Добавляет новую проверку в окно.
+
+        :return: Процент мероприятий с билетами для добавленной проверки
+        """
+        percentage = _percentage(events_with_tickets_count, total_events_count)
+        if len(self._samples) >= self.window:
+            old_with_tickets, _ = self._samples.pop()
+            old_percentage = self._percentages.pop()
+            self._sum -= old_percentage
+            self._sum_sq -= old_percentage * old_percentage
+            if old_with_tickets > 0:
+                self._available_count -= 1
+
+        self._samples.appendleft((events_with_tickets_count, total_events_count))
+        self._percentages.appendleft(percentage)
+        self._sum += percentage
+        self._sum_sq += percentage * percentage
+        if events_with_tickets_count > 0:
+            self._available_count += 1
+
+        if self.ewma is None:
+            self.ewma = percentage
+        else:
+            self.ewma = self.alpha * percentage + (1 - self.alpha) * self.ewma
+        return percentage
+
+    @property
+    def average(self) -> float:
+        """Средний процент мероприятий с билетами за окно (как calculate_average_percentage)."""
+        if self._samples:
+            return self._sum / len(self._samples)
+        return 0.0
+
+    @property
+    def variance(self) -> float:
+        if not self._samples:
+            return 0.0
+        mean = self.average
+        return max(self._sum_sq / len(self._samples) - mean * mean, 0.0)
+
+    @property
+    def std(self) -> float:
+        return sqrt(self.variance)
+
+    @property
+    def last_sample(self) -> Optional[Tuple[int, int]]:
+        """Последняя проверка (events_with_tickets_count, total_events_count) или None."""
+        if self._samples:
+            return self._samples[0]
+        return None
+
+    @property
+    def last_percentage(self) -> float:
+        """Процент мероприятий с билетами на последней проверке."""
+        if self._percentages:
+            return self._percentages[0]
+        return 0.0
+
+    def drop(self, current_percentage: float) -> float:
+        """Падение текущего процента относительно среднего за окно (как calculate_percentage_drop)."""
+        return calculate_percentage_drop(self.average, current_percentage)
+
+    def were_tickets_available(self, last: Optional[int] = None) -> bool:
+        """
+        Проверяет, были ли билеты доступны на последних проверках (как were_tickets_available).
+
+        :param last: Сколько последних проверок учитывать; None - всё окно
+        """
+        if last is None or last >= len(self._samples):
+            return self._available_count > 0
+        if last == 1:
+            return self._samples[0][0] > 0
+        return any(self._samples[index][0] > 0 for index in range(last))
+
+    def samples(self) -> List[Tuple[int, int]]:
+        """:return: Проверки окна (events_with_tickets_count, total_events_count), от новых к старым"""
+        return list(self._samples)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+def _percentage(events_with_tickets_count: int, total_events_count: int) -> float:
+    if total_events_count > 0:
+        return (events_with_tickets_count / total_events_count) * 100
+    return 0.0
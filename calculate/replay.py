@@ -0,0 +1,189 @@
+import gzip
+import json
+import sqlite3
+from datetime import datetime
+from collections import namedtuple
+from heapq import heappop, heappush
+from itertools import count, groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .batch import DROP_THRESHOLD, CURRENT_THRESHOLD, HistoryBuffer, evaluate_batch
+from .rules import RuleContext, RuleEngine
+
+__all__ = ['RuleSettings', 'ReplayAlert', 'ReplayReport',
+           'load_recording', 'load_event_results', 'replay']
+
+RuleSettings = namedtuple('RuleSettings', ['drop_threshold', 'current_threshold', 'z_threshold', 'window'],
+                          defaults=(DROP_THRESHOLD, CURRENT_THRESHOLD, None, 10))
+ReplayAlert = namedtuple('ReplayAlert', ['time', 'site_name', 'kind', 'percentage', 'average', 'drop'])
+# Проверки одной пачки: время и кортежи (site_name, events_with_tickets_count, total_events_count)
+Cycle = Tuple[str, List[Tuple[str, int, int]]]
+
+
+class ReplayReport:
+    def __init__(self, settings: RuleSettings):
+        self.settings = settings
+        self.cycles = 0
+        self.samples = 0
+        self.alerts: List[ReplayAlert] = []
+
+    @property
+    def warnings_count(self) -> int:
+        return sum(alert.kind == 'warning' for alert in self.alerts)
+
+    @property
+    def available_count(self) -> int:
+        return sum(alert.kind == 'available' for alert in self.alerts)
+
+    def counts(self) -> Dict[str, int]:
+        """:return: Количество уведомлений по видам (или по именам правил)"""
+        counts: Dict[str, int] = {}
+        for alert in self.alerts:
+            counts[alert.kind] = counts.get(alert.kind, 0) + 1
+        return counts
+
+
+def load_recording(path: str) -> Iterator[Cycle]:
+    """
+    Читает файл ResponseRecorder.
+
+    :return: Пачки проверок в порядке записи; неизменившиеся ответы подставляются из предыдущих
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    last_payloads: Dict[str, dict] = {}
+    with opener(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            samples = []
+            for site_name, payload in record['responses'].items():
+                if payload is None:
+                    payload = last_payloads.get(site_name)
+                    if payload is None:
+                        continue
+                else:
+                    last_payloads[site_name] = payload
+                samples.append((site_name, payload['events_with_tickets_count'], payload['total_events_count']))
+            yield record['time'], samples
+
+
+def load_event_results(database: str) -> Iterator[Cycle]:
+    """
+    Читает сохраненные проверки из SQLite, группируя их по времени сохранения пачки.
+
+    Повторы неизменившегося ответа (repeat_count) хранятся без времени каждой
+    проверки, поэтому подставляются через равные промежутки между check_time
+    и last_seen строки.
+    """
+    connection = sqlite3.connect(database)
+    try:
+        columns = {row[1] for row in connection.execute('PRAGMA table_info(event_results)')}
+        repeats = 'repeat_count, last_seen' if 'repeat_count' in columns else '0, NULL'
+        rows = connection.execute(f'''
+            SELECT check_time, url, events_with_tickets_count, total_events_count, {repeats}
+            FROM event_results ORDER BY check_time, id
+        ''')
+        for check_time, group in groupby(_expand_repeats(rows), key=lambda sample: sample[0]):
+            yield check_time, [(url, with_tickets, total) for _, url, with_tickets, total in group]
+    finally:
+        connection.close()
+
+
+def _expand_repeats(rows) -> Iterator[Tuple[str, str, int, int]]:
+    """:return: Проверки (check_time, url, events_with_tickets_count, total_events_count) по времени"""
+    # Следующий повтор каждой строки: (время, порядок, url, with, total, номер повтора, всего повторов, начало, шаг)
+    pending = []
+    order = count()
+    for check_time, url, with_tickets, total, repeat_count, last_seen in rows:
+        moment = datetime.fromisoformat(check_time)
+        while pending and pending[0][0] <= moment:
+            yield from _pop_repeat(pending, order)
+        yield check_time, url, with_tickets, total
+        if repeat_count and last_seen:
+            step = (datetime.fromisoformat(last_seen) - moment) / repeat_count
+            heappush(pending, (moment + step, next(order), url, with_tickets, total, 1, repeat_count, moment, step))
+    while pending:
+        yield from _pop_repeat(pending, order)
+
+
+def _pop_repeat(pending: list, order) -> Iterator[Tuple[str, str, int, int]]:
+    moment, _, url, with_tickets, total, number, repeat_count, start, step = heappop(pending)
+    yield moment.isoformat(sep=' '), url, with_tickets, total
+    if number < repeat_count:
+        heappush(pending, (start + step * (number + 1), next(order),
+                           url, with_tickets, total, number + 1, repeat_count, start, step))
+
+
+def replay(cycles: Iterable[Cycle],
+           settings: RuleSettings = RuleSettings(),
+           rules: Optional[RuleEngine] = None) -> ReplayReport:
+    """
+    Прогоняет записанные проверки через логику предупреждений без сети и ожиданий.
+
+    Как и в main.process_results, сайты, данные которых не изменились с
+    прошлой проверки, только пополняют историю и не проверяются, если среди
+    правил нет правил с every_sample.
+
+    :param rules: Движок правил; если задан, пороги settings не используются (кроме window),
+                  а cooldown считается по времени записи
+    """
+    report = ReplayReport(settings)
+    history = HistoryBuffer(window=settings.window)
+    every_sample = rules is not None and rules.every_sample
+    for check_time, samples in cycles:
+        report.cycles += 1
+        report.samples += len(samples)
+        if not samples:
+            continue
+        site_names = [site_name for site_name, _, _ in samples]
+        events_with_tickets_count = np.fromiter((sample[1] for sample in samples), dtype=np.int64, count=len(samples))
+        total_events_count = np.fromiter((sample[2] for sample in samples), dtype=np.int64, count=len(samples))
+        rows = history.rows(site_names)
+        summary = history.summary(rows)
+        changed_mask = (~summary.has_history |
+                        (summary.last_with_tickets != events_with_tickets_count) |
+                        (summary.last_total != total_events_count))
+        selected = np.arange(len(samples)) if every_sample else np.flatnonzero(changed_mask)
+        if len(selected):
+            history_with_tickets, history_total, history_length = history.history(rows[selected])
+            evaluation = evaluate_batch(events_with_tickets_count[selected],
+                                        total_events_count[selected],
+                                        history_with_tickets,
+                                        history_total,
+                                        history_length,
+                                        drop_threshold=settings.drop_threshold,
+                                        current_threshold=settings.current_threshold,
+                                        z_threshold=settings.z_threshold)
+            selected_names = [site_names[index] for index in selected]
+            if rules is not None:
+                context = RuleContext(evaluation, history_with_tickets, history_total, history_length)
+                for fired in rules.evaluate(selected_names, context,
+                                            now=_timestamp(check_time),
+                                            changed=changed_mask[selected] if every_sample else None):
+                    index = fired.index
+                    report.alerts.append(ReplayAlert(check_time,
+                                                     fired.site_name,
+                                                     fired.rule.name,
+                                                     float(evaluation.percentages[index]),
+                                                     float(evaluation.averages[index]),
+                                                     float(evaluation.drops[index])))
+            else:
+                for index in np.flatnonzero(evaluation.warning_mask | evaluation.available_mask):
+                    kind = 'warning' if evaluation.warning_mask[index] else 'available'
+                    report.alerts.append(ReplayAlert(check_time,
+                                                     selected_names[index],
+                                                     kind,
+                                                     float(evaluation.percentages[index]),
+                                                     float(evaluation.averages[index]),
+                                                     float(evaluation.drops[index])))
+        history.add(rows, events_with_tickets_count, total_events_count)
+    return report
+
+
+def _timestamp(check_time) -> float:
+    if isinstance(check_time, datetime):
+        return check_time.timestamp()
+    return datetime.fromisoformat(str(check_time)).timestamp()
@@ -0,0 +1,249 @@
+import json
+import os
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .batch import DROP_THRESHOLD, CURRENT_THRESHOLD, BatchEvaluation
+
+__all__ = ['DEFAULT_RULES', 'RuleContext', 'FiredAlert', 'AlertRule', 'RuleEngine',
+           'compile_rules', 'load_rules']
+
+# Правила по умолчанию повторяют прежнюю логику main.process_results
+DEFAULT_RULES = [
+    {'name': 'drop', 'type': 'drop_over_window',
+     'drop': DROP_THRESHOLD, 'below': CURRENT_THRESHOLD, 'require_last_available': True},
+    {'name': 'reappearance', 'type': 'reappearance', 'checks': 1},
+]
+
+# Тексты по умолчанию для типов без собственного метода в EventMessage
+DEFAULT_TEMPLATES = {
+    'sustained_zero': "⛔ **Внимание!** На сайте {site_name} нет билетов уже несколько проверок подряд.",
+    'threshold_cross': ("📉 **Внимание!** На сайте {site_name} процент мероприятий с билетами "
+                        "пересек порог: с {last_percentage:.0f}% до {percentage:.0f}%."),
+    'below_baseline': ("📉 **Внимание!** На сайте {site_name} процент мероприятий с билетами "
+                       "{percentage:.0f}% ниже обычного уровня {baseline:.0f}%."),
+}
+
+# Типы правил, которым нужны и неизменившиеся проверки: серия одинаковых ответов - их сигнал
+EVERY_SAMPLE_TYPES = {'sustained_zero'}
+
+# Массивы одного цикла, общие для всех правил; история - матрицы (n, window), столбец 0 - последняя проверка
+RuleContext = namedtuple('RuleContext', ['evaluation', 'history_with_tickets', 'history_total', 'history_length'])
+FiredAlert = namedtuple('FiredAlert', ['rule', 'index', 'site_name'])
+
+
+class AlertRule:
+    """Скомпилированное правило: функция, строящая маску сайтов по массивам цикла."""
+
+    def __init__(self, name: str, type: str, mask: Callable[[RuleContext], np.ndarray],
+                 cooldown: float = 0.0, template: Optional[str] = None, every_sample: bool = False):
+        """
+        :param cooldown: Сколько секунд правило не срабатывает повторно для того же сайта
+        :param template: Шаблон текста уведомления (str.format с полями site_name, percentage,
+                         average, last_percentage, drop, z_score, baseline); None - текст по умолчанию для типа
+        :param every_sample: Проверять и сайты, ответ которых не изменился с прошлой проверки
+        """
+        self.name = name
+        self.type = type
+        self.mask = mask
+        self.cooldown = cooldown
+        self.template = template
+        self.every_sample = every_sample
+
+    def format(self, site_name: str, evaluation: BatchEvaluation, index: int) -> Optional[str]:
+        if self.template is None:
+            return None
+        return self.template.format(site_name=site_name,
+                                    rule=self.name,
+                                    percentage=evaluation.percentages[index],
+                                    average=evaluation.averages[index],
+                                    last_percentage=evaluation.last_percentages[index],
+                                    drop=evaluation.drops[index],
+                                    z_score=evaluation.z_scores[index],
+                                    baseline=evaluation.baselines[index])
+
+
+def _drop_over_window(drop=DROP_THRESHOLD, below=None, require_last_available=True, z=None):
+    def mask(context: RuleContext) -> np.ndarray:
+        evaluation = context.evaluation
+        result = evaluation.has_history & (evaluation.drops > drop)
+        if below is not None:
+            result &= evaluation.percentages < below
+        if require_last_available:
+            result &= _available_in_last(context, 1)
+        if z is not None:
+            result &= evaluation.z_scores <= -z
+        return result
+    return mask
+
+
+def _reappearance(checks=1):
+    def mask(context: RuleContext) -> np.ndarray:
+        evaluation = context.evaluation
+        return evaluation.has_history & (evaluation.percentages > 0) & ~_available_in_last(context, checks)
+    return mask
+
+
+def _sustained_zero(checks=3):
+    def mask(context: RuleContext) -> np.ndarray:
+        # Срабатывает один раз - на checks-й подряд проверке без билетов
+        with_tickets = np.asarray(context.history_with_tickets)
+        history_length = np.asarray(context.history_length)
+        zero = context.evaluation.percentages == 0
+        previous = checks - 1
+        if previous > with_tickets.shape[1]:
+            return np.zeros_like(zero)
+        columns = np.arange(with_tickets.shape[1])
+        recent = columns < previous
+        result = zero & (history_length >= previous)
+        result &= ~((with_tickets > 0) & recent).any(axis=1)
+        if previous < with_tickets.shape[1]:
+            before_run = (history_length <= previous) | (with_tickets[:, previous] > 0)
+            result &= before_run
+        return result
+    return mask
+
+
+def _threshold_cross(threshold, direction='down'):
+    def mask(context: RuleContext) -> np.ndarray:
+        evaluation = context.evaluation
+        if direction == 'down':
+            crossed = (evaluation.last_percentages >= threshold) & (evaluation.percentages < threshold)
+        else:
+            crossed = (evaluation.last_percentages < threshold) & (evaluation.percentages >= threshold)
+        return evaluation.has_history & crossed
+    return mask
+
+
+def _below_baseline(drop=DROP_THRESHOLD, below=None):
+    def mask(context: RuleContext) -> np.ndarray:
+        # Базовый уровень - средний процент по дневным агрегатам; сайты без агрегатов не проверяются
+        evaluation = context.evaluation
+        baselines = evaluation.baselines
+        known = ~np.isnan(baselines)
+        result = known & (np.where(known, baselines, 0.0) - evaluation.percentages > drop)
+        if below is not None:
+            result &= evaluation.percentages < below
+        return result
+    return mask
+
+
+def _available_in_last(context: RuleContext, checks: int) -> np.ndarray:
+    with_tickets = np.asarray(context.history_with_tickets)[:, :checks]
+    valid = np.arange(with_tickets.shape[1]) < np.asarray(context.history_length)[:, None]
+    return ((with_tickets > 0) & valid).any(axis=1)
+
+
+RULE_TYPES: Dict[str, Callable] = {
+    'drop_over_window': _drop_over_window,
+    'reappearance': _reappearance,
+    'sustained_zero': _sustained_zero,
+    'threshold_cross': _threshold_cross,
+    'below_baseline': _below_baseline,
+}
+
+
+class RuleEngine:
+    """
+    Набор правил уведомлений, проверяемых для всего цикла сразу.
+
+    Каждое правило - несколько векторных операций над общими массивами
+    цикла, поэтому новое правило не добавляет прохода по сайтам. Перебираются
+    только сработавшие пары (правило, сайт), для них проверяется cooldown.
+
+    Обычно проверяются только сайты, ответ которых изменился. Если есть
+    правила с every_sample, вызывающий передает все сайты цикла и маску
+    changed: остальные правила по неизменившимся сайтам не срабатывают.
+    """
+
+    def __init__(self, rules: Sequence[AlertRule]):
+        self.rules = list(rules)
+        self._last_fired: Dict[Tuple[str, str], float] = {}
+
+    @property
+    def every_sample(self) -> bool:
+        """True, если правилам нужны и неизменившиеся проверки."""
+        return any(rule.every_sample for rule in self.rules)
+
+    def evaluate(self,
+                 site_names: Sequence[str],
+                 context: RuleContext,
+                 now: float,
+                 changed: Optional[np.ndarray] = None) -> List[FiredAlert]:
+        """
+        :param site_names: Сайты цикла в порядке строк массивов
+        :param now: Текущее время в секундах (для cooldown)
+        :param changed: Маска сайтов, ответ которых изменился; None - изменились все
+        :return: Сработавшие уведомления в порядке правил
+        """
+        if not self.rules or not len(site_names):
+            return []
+        masks = np.stack([np.asarray(rule.mask(context), dtype=bool) for rule in self.rules])
+        if changed is not None:
+            only_changed = np.array([not rule.every_sample for rule in self.rules])
+            masks[only_changed] &= np.asarray(changed, dtype=bool)
+        fired = []
+        for rule_index, index in zip(*np.nonzero(masks)):
+            rule = self.rules[rule_index]
+            site_name = site_names[index]
+            key = (rule.name, site_name)
+            if rule.cooldown:
+                last_fired = self._last_fired.get(key)
+                if last_fired is not None and now - last_fired < rule.cooldown:
+                    continue
+                self._last_fired[key] = now
+            fired.append(FiredAlert(rule, int(index), site_name))
+        return fired
+
+    def retain(self, site_names) -> None:
+        """Забывает cooldown сайтов, которых больше нет в списке."""
+        site_names = set(site_names)
+        for key in [key for key in self._last_fired if key[1] not in site_names]:
+            del self._last_fired[key]
+
+
+def compile_rules(config: Sequence[dict]) -> RuleEngine:
+    """
+    Компилирует описание правил в RuleEngine.
+
+    :param config: Список словарей {"name", "type", "cooldown", "template", "every_sample", ...параметры типа}
+    """
+    rules = []
+    names = set()
+    for rule_config in config:
+        rule_config = dict(rule_config)
+        name = rule_config.pop('name')
+        rule_type = rule_config.pop('type')
+        cooldown = float(rule_config.pop('cooldown', 0))
+        template = rule_config.pop('template', None)
+        every_sample = bool(rule_config.pop('every_sample', rule_type in EVERY_SAMPLE_TYPES))
+        if name in names:
+            raise ValueError(f"Duplicate alert rule name: {name}")
+        if rule_type not in RULE_TYPES:
+            raise ValueError(f"Unknown alert rule type {rule_type} in rule {name}")
+        try:
+            mask = RULE_TYPES[rule_type](**rule_config)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for alert rule {name}: {e}") from e
+        names.add(name)
+        rules.append(AlertRule(name, rule_type, mask,
+                               cooldown=cooldown,
+                               template=template or DEFAULT_TEMPLATES.get(rule_type),
+                               every_sample=every_sample))
+    return RuleEngine(rules)
+
+
+def load_rules(path: Optional[str] = None) -> RuleEngine:
+    """
+    Загружает правила из JSON-файла; без пути используются DEFAULT_RULES.
+
+    :raises FileNotFoundError: Если путь указан, но файла нет
+    """
+    if not path:
+        return compile_rules(DEFAULT_RULES)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Alert rules file not found: {path}")
+    with open(path, 'r', encoding='utf-8') as file:
+        return compile_rules(json.load(file))
@@ -1,3 +1,8 @@
 from .db_sqlite import *
+from .backend import ResultsBackend
+from .history import HistoryCache
+from .compaction import RollupCompactor
+from .outbox import Outbox, OutboxEntry
 from .utils import *
 from .db_postgresql import DBConnection
+from .results_postgresql import PostgresResultsBackend
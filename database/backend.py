@@ -0,0 +1,96 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+class ResultsBackend(ABC):
+    """
+    Хранилище истории проверок.
+
+    Реализации: SQLiteStore (локальный файл) и PostgresResultsBackend
+    (общая история для нескольких экземпляров проверки).
+    """
+
+    @abstractmethod
+    async def init_db(self) -> None:
+        ...
+
+    @abstractmethod
+    async def save_results(self, results: Iterable[Tuple[str, int, int, int]]) -> None:
+        """
+        Сохраняет результаты порции проверок одной операцией.
+
+        Изменившиеся проверки добавляются строками. Неизменившиеся (changed=False
+        в CycleResults) только увеличивают repeat_count и last_seen последней
+        строки сайта; если ее значения отличаются, добавляется новая строка.
+
+        :param results: CycleResults или кортежи (url, total_events_count, events_with_tickets_count, events_without_tickets_count, ...)
+        """
+
+    @abstractmethod
+    async def load_history(self, urls: Iterable[str], limit=10) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Загружает последние результаты сразу для всех сайтов одним запросом.
+
+        :return: Словарь url -> список (events_with_tickets_count, total_events_count), от новых к старым;
+                 строка с repeat_count повторяется repeat_count + 1 раз
+        """
+
+    @abstractmethod
+    async def compact_chunk(self, cutoff: datetime, limit=5000) -> int:
+        """
+        Сворачивает до limit сырых проверок самого старого часа старше cutoff
+        в почасовые и дневные агрегаты и удаляет свернутые строки.
+
+        :return: Количество свернутых строк; 0, если сворачивать нечего
+        """
+
+    @abstractmethod
+    async def prune_rollups(self, cutoff: datetime, period='hourly') -> int:
+        """Удаляет агрегаты period старше cutoff."""
+
+    @abstractmethod
+    async def get_rollups(self, urls: Iterable[str], period='daily', limit=30
+                          ) -> Dict[str, List[Tuple[float, float, float, int]]]:
+        """
+        Загружает последние агрегаты сразу для всех сайтов одним запросом.
+
+        :param period: 'hourly' или 'daily'
+        :return: Словарь url -> агрегаты (min_percentage, max_percentage, mean_percentage, sample_count),
+                 от новых к старым
+        """
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+
+def result_records(results, check_time: datetime, changed=True) -> Iterator[tuple]:
+    """
+    Строки для event_results без промежуточного списка.
+
+    :param results: CycleResults или кортежи (url, total_events_count, events_with_tickets_count, events_without_tickets_count, ...)
+    :param changed: True - проверки для вставки, False - неизменившиеся проверки (у кортежей их нет)
+    """
+    records = getattr(results, 'records', None)
+    if records is not None:
+        return records(check_time, changed)
+    if not changed:
+        return iter(())
+    return ((*result[:4], check_time) for result in results)
+
+
+def expand_repeats(rows: Iterable[Tuple[int, int, int]], limit: int) -> List[Tuple[int, int]]:
+    """
+    Разворачивает строки истории с повторами в отдельные проверки.
+
+    :param rows: Кортежи (events_with_tickets_count, total_events_count, repeat_count), от новых к старым
+    :return: Не больше limit проверок (events_with_tickets_count, total_events_count), от новых к старым
+    """
+    samples = []
+    for events_with_tickets_count, total_events_count, repeat_count in rows:
+        count = min(repeat_count + 1, limit - len(samples))
+        samples.extend([(events_with_tickets_count, total_events_count)] * count)
+        if len(samples) >= limit:
+            break
+    return samples
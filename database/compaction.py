@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from .backend import ResultsBackend
+
+
+class RollupCompactor:
+    """
+    Фоновое сжатие истории проверок.
+
+    Сырые проверки старше raw_retention сворачиваются в почасовые и дневные
+    агрегаты порциями не больше chunk_rows строк одного часа, между порциями
+    управление отдается циклу проверок. Почасовые агрегаты старше hourly_retention удаляются,
+    дневные хранятся бессрочно.
+    """
+
+    def __init__(self,
+                 backend: ResultsBackend,
+                 raw_retention=timedelta(days=14),
+                 hourly_retention=timedelta(days=180),
+                 interval=3600,
+                 chunk_pause=0.1,
+                 chunk_rows=5000,
+                 logger=None):
+        """
+        :param backend: Хранилище истории проверок
+        :param raw_retention: Сколько хранить сырые проверки
+        :param hourly_retention: Сколько хранить почасовые агрегаты
+        :param interval: Пауза между проходами сжатия в секундах
+        :param chunk_pause: Пауза между порциями внутри прохода
+        :param chunk_rows: Сколько строк сворачивается одной транзакцией
+        """
+        self.backend = backend
+        self.raw_retention = raw_retention
+        self.hourly_retention = hourly_retention
+        self.interval = interval
+        self.chunk_pause = chunk_pause
+        self.chunk_rows = chunk_rows
+        self.logger = logger
+
+    async def compact(self) -> int:
+        """Сворачивает все сырые проверки старше raw_retention и возвращает их количество."""
+        cutoff = datetime.now() - self.raw_retention
+        compacted = 0
+        while True:
+            rows = await self.backend.compact_chunk(cutoff, limit=self.chunk_rows)
+            if not rows:
+                break
+            compacted += rows
+            await asyncio.sleep(self.chunk_pause)
+        await self.backend.prune_rollups(datetime.now() - self.hourly_retention, period='hourly')
+        return compacted
+
+    async def run(self) -> None:
+        while True:
+            try:
+                compacted = await self.compact()
+                if compacted and self.logger:
+                    self.logger.info(f"Compacted {compacted} raw results into rollups")
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Error compacting results history: {e}")
+            await asyncio.sleep(self.interval)
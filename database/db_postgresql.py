@@ -1,9 +1,10 @@
 import os
 import json
+import time
 import asyncio
 import asyncpg
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator, List
+from typing import AsyncGenerator, List, Optional
 import aiofiles
 from dotenv import load_dotenv
 
@@ -14,6 +15,12 @@ DB_PORT = os.getenv('DB_PORT')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_DATABASE = os.getenv('DB_DATABASE')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 5))
+# Как долго список сайтов считается актуальным без уведомления об изменении
+SITES_CACHE_TTL = float(os.getenv('SITES_CACHE_TTL', 300))
+# Канал LISTEN/NOTIFY, в который публикуются изменения tables_sites (необязательно)
+SITES_NOTIFY_CHANNEL = os.getenv('SITES_NOTIFY_CHANNEL')
 
 class DBConnection:
     def __init__(self,
@@ -26,7 +33,11 @@ class DBConnection:
                  use_json=False,
                  retry_attempts=5,
                  retry_delay=5,
-                 backup_file='backup_sites.json'):
+                 backup_file='backup_sites.json',
+                 min_pool_size=DB_POOL_MIN_SIZE,
+                 max_pool_size=DB_POOL_MAX_SIZE,
+                 sites_ttl=SITES_CACHE_TTL,
+                 notify_channel=SITES_NOTIFY_CHANNEL):
         self.host = host
         self.port = str(port)
         self.user = user
@@ -37,7 +48,15 @@ class DBConnection:
         self.retry_attempts = retry_attempts
         self.retry_delay = retry_delay
         self.backup_file = self._get_backup_path(backup_file)
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max_pool_size
+        self.sites_ttl = sites_ttl
+        self.notify_channel = notify_channel
         self.pool = None
+        self._listen_connection: Optional[asyncpg.Connection] = None
+        self._sites: Optional[List[str]] = None
+        self._sites_loaded_at = 0.0
+        self._backup_sites: Optional[List[str]] = None
 
     @staticmethod
     def _get_backup_path(name) -> str:
@@ -53,7 +72,10 @@ class DBConnection:
                                                       password=self.password,
                                                       host=self.host,
                                                       port=self.port,
-                                                      database=self.database)
+                                                      database=self.database,
+                                                      min_size=self.min_pool_size,
+                                                      max_size=self.max_pool_size)
+                await self._listen_sites()
                 break
             except (asyncpg.PostgresError, OSError) as e:
                 if attempt < self.retry_attempts - 1:
@@ -71,24 +93,62 @@ class DBConnection:
             async with connection.transaction():
                 yield connection
 
+    async def _listen_sites(self) -> None:
+        if not self.notify_channel:
+            return
+        try:
+            self._listen_connection = await asyncpg.connect(user=self.user,
+                                                            password=self.password,
+                                                            host=self.host,
+                                                            port=self.port,
+                                                            database=self.database)
+            await self._listen_connection.add_listener(self.notify_channel, self._on_sites_changed)
+        except (asyncpg.PostgresError, OSError) as e:
+            self._listen_connection = None
+            if self.logger:
+                self.logger.error(f"Could not listen to {self.notify_channel}, relying on cache TTL: {e}")
+
+    def _on_sites_changed(self, connection, pid, channel, payload) -> None:
+        self._sites = None
+
+    def invalidate_sites(self) -> None:
+        self._sites = None
+
     async def get_sites(self) -> List[str]:
         if self.use_json:
             return await self.load_backup_data()
+        if self._sites is not None and time.monotonic() - self._sites_loaded_at < self.sites_ttl:
+            return self._sites
         try:
-            async with self.get_cursor() as conn:
-                sites = await conn.fetch('SELECT name FROM public.tables_sites WHERE site_check=True')
-                sites = [row['name'] for row in sites]
-                await self.save_backup_data(sites)
-                return sites
+            if not self.pool:
+                await self.connect_db()
+            async with self.pool.acquire(timeout=30) as conn:
+                # Порядок нужен стабильный, иначе сравнение с резервной копией видит изменения
+                sites = await conn.fetch('SELECT name FROM public.tables_sites WHERE site_check=True ORDER BY name')
+            sites = [row['name'] for row in sites]
+            self._sites = sites
+            self._sites_loaded_at = time.monotonic()
+            await self.save_backup_data(sites)
+            return sites
         except (Exception, asyncpg.PostgresError) as e:
             if self.logger:
                 self.logger.error(f"Error fetching sites from the database: {e}")
+            if self._sites is not None:
+                return self._sites
             return await self.load_backup_data()
 
     async def save_backup_data(self, data) -> None:
+        temp_file = f"{self.backup_file}.tmp"
         try:
-            async with aiofiles.open(self.backup_file, 'w') as f:
+            if self._backup_sites is None:
+                await self.load_backup_data()
+            if data == self._backup_sites:
+                return
+            async with aiofiles.open(temp_file, 'w') as f:
                 await f.write(json.dumps(data, indent=2))
+            # Переименование атомарно: файл не останется наполовину записанным
+            os.replace(temp_file, self.backup_file)
+            self._backup_sites = list(data)
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Error saving backup data: {e}")
@@ -97,11 +157,21 @@ class DBConnection:
         try:
             async with aiofiles.open(self.backup_file, 'r') as f:
                 data = json.loads(await f.read())
+            self._backup_sites = list(data)
             return data
         except FileNotFoundError:
             return []
+        except ValueError as e:
+            # Поврежденная копия (например, обрезанная прежней неатомарной записью):
+            # _backup_sites остается None, и save_backup_data перезапишет файл
+            if self.logger:
+                self.logger.error(f"Backup file {self.backup_file} is corrupt: {e}")
+            return []
 
     async def close(self) -> None:
+        if self._listen_connection is not None:
+            await self._listen_connection.close()
+            self._listen_connection = None
         if self.pool:
             await self.pool.close()
 
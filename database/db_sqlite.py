@@ -1,34 +1,265 @@
+import json
+import asyncio
 import aiosqlite
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Tuple
+
+from .backend import ResultsBackend, expand_repeats, result_records
 
 DATABASE = 'database/events.db'
+ROLLUP_TABLES = {'hourly': 'event_results_hourly', 'daily': 'event_results_daily'}
+# Сколько сырых строк сворачивается одной транзакцией; транзакция держит _write_lock
+COMPACT_CHUNK_ROWS = 5000
+# Последняя строка сайта; к ней добавляются повторы неизменившегося ответа
+LATEST_RESULT = '''
+    SELECT id FROM event_results WHERE url = :url ORDER BY check_time DESC LIMIT 1
+'''
+
+
+class SQLiteStore(ResultsBackend):
+    """
+    Долгоживущее хранилище результатов проверок.
+
+    Держит одно открытое соединение на всё время работы процесса,
+    работает в режиме WAL и записывает результаты цикла одной транзакцией.
+    """
 
-async def init_db():
-    async with aiosqlite.connect(DATABASE) as db:
-        await db.execute('''
+    def __init__(self, database=DATABASE, logger=None):
+        self.database = database
+        self.logger = logger
+        self.db: Optional[aiosqlite.Connection] = None
+        # Соединение общее, поэтому транзакции разных корутин не должны перемешиваться
+        self._write_lock = asyncio.Lock()
+
+    async def connect_db(self) -> None:
+        if self.db is not None:
+            return
+        self.db = await aiosqlite.connect(self.database)
+        await self.db.execute('PRAGMA journal_mode=WAL')
+        await self.db.execute('PRAGMA synchronous=NORMAL')
+
+    async def init_db(self) -> None:
+        await self.connect_db()
+        await self.db.execute('''
             CREATE TABLE IF NOT EXISTS event_results (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 url TEXT,
                 total_events_count INTEGER,
                 events_with_tickets_count INTEGER,
                 events_without_tickets_count INTEGER,
-                check_time TIMESTAMP
+                check_time TIMESTAMP,
+                repeat_count INTEGER NOT NULL DEFAULT 0,
+                last_seen TIMESTAMP
             )
         ''')
-        await db.commit()
-
-async def save_site_result_to_db(url, total_events_count, events_with_tickets_count, events_without_tickets_count):
-    async with aiosqlite.connect(DATABASE) as db:
-        await db.execute('''
-            INSERT INTO event_results (url, total_events_count, events_with_tickets_count, events_without_tickets_count, check_time)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (url, total_events_count, events_with_tickets_count, events_without_tickets_count, datetime.now()))
-        await db.commit()
-
-async def get_previous_results(url, limit=10):
-    async with aiosqlite.connect(DATABASE) as db:
-        async with db.execute('''
+        # Базы, созданные до появления повторов
+        async with self.db.execute('PRAGMA table_info(event_results)') as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if 'repeat_count' not in columns:
+            await self.db.execute('ALTER TABLE event_results ADD COLUMN repeat_count INTEGER NOT NULL DEFAULT 0')
+            await self.db.execute('ALTER TABLE event_results ADD COLUMN last_seen TIMESTAMP')
+        # Покрывающий индекс: выборка истории по сайту не обращается к самой таблице
+        await self.db.execute('DROP INDEX IF EXISTS idx_event_results_url_check_time')
+        await self.db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_event_results_history
+            ON event_results (url, check_time, events_with_tickets_count, total_events_count, repeat_count)
+        ''')
+        # Для поиска самых старых строк при сжатии истории
+        await self.db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_event_results_check_time
+            ON event_results (check_time)
+        ''')
+        for table in ROLLUP_TABLES.values():
+            await self.db.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    url TEXT,
+                    bucket TIMESTAMP,
+                    min_percentage REAL,
+                    max_percentage REAL,
+                    sum_percentage REAL,
+                    sample_count INTEGER,
+                    PRIMARY KEY (url, bucket)
+                )
+            ''')
+        await self.db.commit()
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncGenerator[aiosqlite.Connection, None]:
+        await self.connect_db()
+        async with self._write_lock:
+            try:
+                yield self.db
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                raise
+
+    async def save_results(self, results: Iterable[Tuple[str, int, int, int]]) -> None:
+        """
+        Сохраняет результаты всего цикла одной транзакцией.
+
+        Неизменившиеся проверки не добавляют строк, а увеличивают repeat_count
+        последней строки сайта.
+
+        :param results: CycleResults или кортежи (url, total_events_count, events_with_tickets_count, events_without_tickets_count, ...)
+        """
+        if not results:
+            return
+        check_time = datetime.now()
+        try:
+            async with self.transaction() as db:
+                await db.executemany('''
+                    INSERT INTO event_results (url, total_events_count, events_with_tickets_count, events_without_tickets_count, check_time)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', result_records(results, check_time))
+                heartbeats = [_heartbeat_params(record)
+                              for record in result_records(results, check_time, changed=False)]
+                if heartbeats:
+                    await db.executemany(f'''
+                        UPDATE event_results SET repeat_count = repeat_count + 1, last_seen = :check_time
+                        WHERE id = ({LATEST_RESULT})
+                          AND total_events_count = :total
+                          AND events_with_tickets_count = :with_tickets
+                          AND events_without_tickets_count = :without_tickets
+                    ''', heartbeats)
+                    # Сайты без подходящей последней строки (например, свернутой в агрегаты) получают новую
+                    await db.executemany(f'''
+                        INSERT INTO event_results (url, total_events_count, events_with_tickets_count, events_without_tickets_count, check_time)
+                        SELECT :url, :total, :with_tickets, :without_tickets, :check_time
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM event_results WHERE id = ({LATEST_RESULT}) AND last_seen = :check_time
+                        )
+                    ''', heartbeats)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Error saving {len(results)} results to the database: {e}")
+            raise
+
+    async def get_previous_results(self, url, limit=10) -> List[Tuple[int, int]]:
+        await self.connect_db()
+        async with self.db.execute('''
             SELECT events_with_tickets_count, total_events_count FROM event_results
             WHERE url = ? ORDER BY check_time DESC LIMIT ?
         ''', (url, limit)) as cursor:
-            return await cursor.fetchall()
\ No newline at end of file
+            return await cursor.fetchall()
+
+    async def load_history(self, urls: Iterable[str], limit=10) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Загружает последние результаты сразу для всех сайтов одним запросом.
+
+        :param urls: Сайты, для которых нужна история
+        :param limit: Количество последних проверок на сайт
+        :return: Словарь url -> список (events_with_tickets_count, total_events_count), от новых к старым
+        """
+        await self.connect_db()
+        history: Dict[str, List[Tuple[int, int]]] = {}
+        rows: Dict[str, List[Tuple[int, int, int]]] = {}
+        # Каждая строка - хотя бы одна проверка, поэтому limit строк на сайт достаточно
+        async with self.db.execute('''
+            SELECT url, events_with_tickets_count, total_events_count, repeat_count FROM (
+                SELECT url, events_with_tickets_count, total_events_count, repeat_count, check_time,
+                       ROW_NUMBER() OVER (PARTITION BY url ORDER BY check_time DESC) AS rn
+                FROM event_results
+                WHERE url IN (SELECT value FROM json_each(?))
+            )
+            WHERE rn <= ?
+            ORDER BY url, check_time DESC
+        ''', (json.dumps(list(urls)), limit)) as cursor:
+            async for url, events_with_tickets_count, total_events_count, repeat_count in cursor:
+                rows.setdefault(url, []).append((events_with_tickets_count, total_events_count, repeat_count))
+        for url, url_rows in rows.items():
+            history[url] = expand_repeats(url_rows, limit)
+        return history
+
+    async def compact_chunk(self, cutoff: datetime, limit=COMPACT_CHUNK_ROWS) -> int:
+        await self.connect_db()
+        async with self.db.execute('SELECT MIN(check_time) FROM event_results') as cursor:
+            row = await cursor.fetchone()
+        if not row or row[0] is None:
+            return 0
+        start = hour_bucket(_parse_timestamp(row[0]))
+        end = start + timedelta(hours=1)
+        if end > cutoff:
+            return 0
+
+        # Не больше limit строк часа: порядок (check_time, id) совпадает с индексом и не меняется внутри транзакции
+        chunk = '''
+            SELECT id FROM event_results
+            WHERE check_time >= ? AND check_time < ?
+            ORDER BY check_time, id LIMIT ?
+        '''
+        async with self.transaction() as db:
+            for period, table in ROLLUP_TABLES.items():
+                bucket = start if period == 'hourly' else day_bucket(start)
+                await db.execute(f'''
+                    INSERT INTO {table} (url, bucket, min_percentage, max_percentage, sum_percentage, sample_count)
+                    SELECT url, ?, MIN(percentage), MAX(percentage), SUM(percentage * samples), SUM(samples) FROM (
+                        SELECT url,
+                               CASE WHEN total_events_count > 0
+                                    THEN events_with_tickets_count * 100.0 / total_events_count
+                                    ELSE 0 END AS percentage,
+                               repeat_count + 1 AS samples
+                        FROM event_results
+                        WHERE id IN ({chunk})
+                    )
+                    GROUP BY url
+                    ON CONFLICT (url, bucket) DO UPDATE SET
+                        min_percentage = MIN(min_percentage, excluded.min_percentage),
+                        max_percentage = MAX(max_percentage, excluded.max_percentage),
+                        sum_percentage = sum_percentage + excluded.sum_percentage,
+                        sample_count = sample_count + excluded.sample_count
+                ''', (bucket, start, end, limit))
+            cursor = await db.execute(f'DELETE FROM event_results WHERE id IN ({chunk})',
+                                      (start, end, limit))
+            return cursor.rowcount
+
+    async def prune_rollups(self, cutoff: datetime, period='hourly') -> int:
+        async with self.transaction() as db:
+            cursor = await db.execute(f'DELETE FROM {ROLLUP_TABLES[period]} WHERE bucket < ?', (cutoff,))
+            return cursor.rowcount
+
+    async def get_rollups(self, urls: Iterable[str], period='daily', limit=30
+                          ) -> Dict[str, List[Tuple[float, float, float, int]]]:
+        await self.connect_db()
+        rollups: Dict[str, List[Tuple[float, float, float, int]]] = {}
+        async with self.db.execute(f'''
+            SELECT url, min_percentage, max_percentage, sum_percentage / sample_count, sample_count FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY url ORDER BY bucket DESC) AS rn
+                FROM {ROLLUP_TABLES[period]}
+                WHERE url IN (SELECT value FROM json_each(?))
+            )
+            WHERE rn <= ?
+            ORDER BY url, bucket DESC
+        ''', (json.dumps(list(urls)), limit)) as cursor:
+            async for url, *rollup in cursor:
+                rollups.setdefault(url, []).append(tuple(rollup))
+        return rollups
+
+    async def close(self) -> None:
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
+
+
+def _heartbeat_params(record: tuple) -> dict:
+    url, total_events_count, events_with_tickets_count, events_without_tickets_count, check_time = record
+    return {'url': url,
+            'total': total_events_count,
+            'with_tickets': events_with_tickets_count,
+            'without_tickets': events_without_tickets_count,
+            'check_time': check_time}
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _parse_timestamp(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
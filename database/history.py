@@ -0,0 +1,56 @@
+import time
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from calculate import HistoryBuffer, calculate_baseline_percentage
+from .backend import ResultsBackend
+
+# Базовый уровень сайта - средний процент по дневным агрегатам за столько дней
+BASELINE_DAYS = 30
+# Агрегаты пополняются при сжатии истории раз в час, чаще перечитывать их незачем
+BASELINE_REFRESH_INTERVAL = 3600
+
+
+class HistoryCache(HistoryBuffer):
+    """
+    Окна последних проверок всех сайтов.
+
+    Заменяет запрос get_previous_results на каждый сайт в каждом цикле:
+    история читается из базы одним запросом при появлении сайта,
+    а дальше обновляется в памяти при сохранении результатов. Базовые
+    уровни сайтов (правило below_baseline) читаются из дневных агрегатов
+    и обновляются раз в BASELINE_REFRESH_INTERVAL.
+    """
+
+    def __init__(self, limit=10, baseline_days=BASELINE_DAYS):
+        super().__init__(window=limit)
+        self.limit = limit
+        self.baseline_days = baseline_days
+        self._baselines_loaded_at = None
+
+    async def sync(self, store: ResultsBackend, site_names: Iterable[str]) -> None:
+        """
+        Оставляет в кэше только актуальные сайты и догружает историю новых.
+
+        :param store: Хранилище результатов проверок
+        :param site_names: Сайты, возвращенные DBConnection.get_sites
+        """
+        site_names = set(site_names)
+        self.remove([site_name for site_name in self.site_names() if site_name not in site_names])
+        new_sites = [site_name for site_name in site_names if site_name not in self]
+        if new_sites:
+            history = await store.load_history(new_sites, limit=self.limit)
+            self.load(new_sites, [history.get(site_name) for site_name in new_sites])
+        now = time.monotonic()
+        if self._baselines_loaded_at is None or now - self._baselines_loaded_at >= BASELINE_REFRESH_INTERVAL:
+            self._baselines_loaded_at = now
+            await self.load_baselines(store, self.site_names())
+        elif new_sites:
+            await self.load_baselines(store, new_sites)
+
+    async def load_baselines(self, store: ResultsBackend, site_names: Sequence[str]) -> None:
+        rollups = await store.get_rollups(site_names, period='daily', limit=self.baseline_days)
+        self.set_baselines(site_names, [calculate_baseline_percentage(rollups[site_name])
+                                        if site_name in rollups else np.nan
+                                        for site_name in site_names])
@@ -0,0 +1,182 @@
+import json
+import time
+import asyncio
+from typing import Callable, List, Optional
+
+from .db_sqlite import SQLiteStore
+
+# Сколько раз сообщение передается диспетчеру (у которого свои повторы), прежде чем уйти в outbox_dead
+MAX_DELIVERY_ATTEMPTS = 5
+
+
+class OutboxEntry:
+    __slots__ = ('id', 'chat_id', 'type', 'message', 'acked')
+
+    def __init__(self, chat_id: int, type: str, message: str, id: Optional[int] = None):
+        self.id = id
+        self.chat_id = chat_id
+        self.type = type
+        self.message = message
+        self.acked = False
+
+
+class Outbox:
+    """
+    Персистентная очередь исходящих сообщений в Telegram.
+
+    Новые сообщения копятся в памяти и записываются в таблицу outbox
+    пачками раз в flush_interval, поэтому постановка в очередь не ждет
+    записи на диск. Записанная строка арендуется диспетчером на
+    lease_timeout секунд и удаляется после подтверждения отправки.
+    Неподтвержденные строки с истекшей арендой и все строки, оставшиеся
+    после падения процесса, отправляются повторно (at-least-once).
+    Сообщение, которое не удалось отправить max_attempts раз (например,
+    из-за неверного id канала), переносится в таблицу outbox_dead.
+    """
+
+    def __init__(self, store: SQLiteStore, flush_interval=0.5, lease_timeout=600,
+                 max_attempts=MAX_DELIVERY_ATTEMPTS, logger=None):
+        """
+        :param store: Хранилище, в базе которого лежит таблица outbox
+        :param flush_interval: Как часто записывать накопленные сообщения и подтверждения
+        :param lease_timeout: Через сколько секунд неподтвержденное сообщение отправляется повторно
+        :param max_attempts: Сколько раз передавать сообщение диспетчеру до переноса в outbox_dead
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.logger = logger
+        self._pending: List[OutboxEntry] = []
+        self._acked_ids: List[int] = []
+
+    async def init_db(self) -> None:
+        async with self.store.transaction() as db:
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    type TEXT,
+                    message TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    leased_until REAL,
+                    attempts INTEGER DEFAULT 0
+                )
+            ''')
+            async with db.execute('PRAGMA table_info(outbox)') as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if 'attempts' not in columns:
+                await db.execute('ALTER TABLE outbox ADD COLUMN attempts INTEGER DEFAULT 0')
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS outbox_dead (
+                    id INTEGER PRIMARY KEY,
+                    chat_id INTEGER,
+                    type TEXT,
+                    message TEXT,
+                    created_at TIMESTAMP,
+                    attempts INTEGER,
+                    failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+    def enqueue(self, chat_id: int, message: str, type='send') -> OutboxEntry:
+        entry = OutboxEntry(chat_id, type, message)
+        self._pending.append(entry)
+        return entry
+
+    def ack(self, entry: OutboxEntry) -> None:
+        """Подтверждает отправку; еще не записанное сообщение просто не попадет в базу."""
+        if entry.acked:
+            return
+        entry.acked = True
+        if entry.id is not None:
+            self._acked_ids.append(entry.id)
+
+    async def flush(self) -> None:
+        pending = [entry for entry in self._pending if not entry.acked]
+        self._pending = []
+        acked_ids, self._acked_ids = self._acked_ids, []
+        if not pending and not acked_ids:
+            return
+        leased_until = time.time() + self.lease_timeout
+        try:
+            async with self.store.transaction() as db:
+                for entry in pending:
+                    # Первая попытка - отправка сразу при постановке в очередь
+                    cursor = await db.execute('''
+                        INSERT INTO outbox (chat_id, type, message, leased_until, attempts)
+                        VALUES (?, ?, ?, ?, 1)
+                    ''', (entry.chat_id, entry.type, entry.message, leased_until))
+                    entry.id = cursor.lastrowid
+                if acked_ids:
+                    await db.execute('DELETE FROM outbox WHERE id IN (SELECT value FROM json_each(?))',
+                                     (json.dumps(acked_ids),))
+        except Exception as e:
+            for entry in pending:
+                entry.id = None
+            self._pending = pending + self._pending
+            self._acked_ids.extend(acked_ids)
+            if self.logger:
+                self.logger.error(f"Error flushing outbox: {e}")
+            return
+        # Подтверждения, пришедшие во время записи, удаляются следующим flush
+        self._acked_ids.extend(entry.id for entry in pending if entry.acked)
+
+    async def lease(self, reclaim=False) -> List[OutboxEntry]:
+        """
+        Арендует неподтвержденные сообщения для повторной отправки.
+
+        Сообщения, исчерпавшие max_attempts, переносятся в outbox_dead.
+
+        :param reclaim: Забрать все сообщения, включая арендованные (при старте процесса)
+        """
+        now = time.time()
+        async with self.store.transaction() as db:
+            async with db.execute('''
+                SELECT id, chat_id, type, message, attempts FROM outbox
+                WHERE ? OR leased_until IS NULL OR leased_until < ?
+                ORDER BY id
+            ''', (reclaim, now)) as cursor:
+                rows = await cursor.fetchall()
+            dead = [row for row in rows if (row[4] or 0) >= self.max_attempts]
+            rows = [row for row in rows if (row[4] or 0) < self.max_attempts]
+            if dead:
+                dead_ids = json.dumps([row[0] for row in dead])
+                await db.execute('''
+                    INSERT INTO outbox_dead (id, chat_id, type, message, created_at, attempts)
+                    SELECT id, chat_id, type, message, created_at, attempts FROM outbox
+                    WHERE id IN (SELECT value FROM json_each(?))
+                ''', (dead_ids,))
+                await db.execute('DELETE FROM outbox WHERE id IN (SELECT value FROM json_each(?))', (dead_ids,))
+            if rows:
+                await db.execute('''
+                    UPDATE outbox SET leased_until = ?, attempts = COALESCE(attempts, 0) + 1
+                    WHERE id IN (SELECT value FROM json_each(?))
+                ''', (now + self.lease_timeout, json.dumps([row[0] for row in rows])))
+        if dead and self.logger:
+            for id, chat_id, type, message, attempts in dead:
+                self.logger.error(f"Outbox message {id} to chat {chat_id} failed {attempts} times, "
+                                  f"moved to outbox_dead: {message[:100]!r}")
+        return [OutboxEntry(chat_id, type, message, id=id) for id, chat_id, type, message, _ in rows]
+
+    async def run(self, dispatch: Callable[[OutboxEntry], None]) -> None:
+        """
+        Периодически записывает очередь и переотправляет сообщения с истекшей арендой.
+
+        :param dispatch: Передает арендованное сообщение диспетчеру
+        """
+        last_lease = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - last_lease >= self.lease_timeout:
+                last_lease = time.monotonic()
+                try:
+                    for entry in await self.lease():
+                        dispatch(entry)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Error leasing outbox messages: {e}")
+
+    def __len__(self) -> int:
+        return len(self._pending)
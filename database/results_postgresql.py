@@ -0,0 +1,255 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .backend import ResultsBackend, expand_repeats, result_records
+from .db_postgresql import DBConnection
+from .db_sqlite import COMPACT_CHUNK_ROWS, day_bucket, hour_bucket
+
+RESULT_COLUMNS = ['url', 'total_events_count', 'events_with_tickets_count',
+                  'events_without_tickets_count', 'check_time']
+ROLLUP_PERIODS = ('hourly', 'daily')
+
+
+class PostgresResultsBackend(ResultsBackend):
+    """
+    История проверок в Postgres.
+
+    Таблица секционирована по месяцам check_time, секции создаются по мере
+    необходимости. Результаты порции пишутся одним COPY, история для всех
+    сайтов читается одним запросом.
+    """
+
+    def __init__(self, connection: DBConnection, table='event_results', logger=None):
+        """
+        :param connection: Подключение с пулом asyncpg
+        :param table: Имя секционированной таблицы в схеме public
+        """
+        self.connection = connection
+        self.table = table
+        self.logger = logger
+        self._partitions: Set[str] = set()
+
+    async def init_db(self) -> None:
+        async with self.connection.get_cursor() as conn:
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS public.{self.table} (
+                    url TEXT NOT NULL,
+                    total_events_count INTEGER,
+                    events_with_tickets_count INTEGER,
+                    events_without_tickets_count INTEGER,
+                    check_time TIMESTAMP NOT NULL,
+                    repeat_count INTEGER NOT NULL DEFAULT 0,
+                    last_seen TIMESTAMP
+                ) PARTITION BY RANGE (check_time)
+            ''')
+            # Таблицы, созданные до появления повторов
+            await conn.execute(f'''
+                ALTER TABLE public.{self.table}
+                    ADD COLUMN IF NOT EXISTS repeat_count INTEGER NOT NULL DEFAULT 0,
+                    ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP
+            ''')
+            await conn.execute(f'DROP INDEX IF EXISTS public.idx_{self.table}_url_check_time')
+            await conn.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_{self.table}_history
+                ON public.{self.table} (url, check_time DESC)
+                INCLUDE (events_with_tickets_count, total_events_count, repeat_count)
+            ''')
+            for period in ROLLUP_PERIODS:
+                await conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS public.{self.table}_{period} (
+                        url TEXT NOT NULL,
+                        bucket TIMESTAMP NOT NULL,
+                        min_percentage DOUBLE PRECISION,
+                        max_percentage DOUBLE PRECISION,
+                        sum_percentage DOUBLE PRECISION,
+                        sample_count INTEGER,
+                        PRIMARY KEY (url, bucket)
+                    )
+                ''')
+
+    async def _ensure_partition(self, conn, check_time: datetime) -> str:
+        month_start = check_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if month_start.month == 12:
+            month_end = month_start.replace(year=month_start.year + 1, month=1)
+        else:
+            month_end = month_start.replace(month=month_start.month + 1)
+        partition = f"{self.table}_{month_start:%Y_%m}"
+        if partition not in self._partitions:
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS public.{partition}
+                PARTITION OF public.{self.table}
+                FOR VALUES FROM ('{month_start:%Y-%m-%d}') TO ('{month_end:%Y-%m-%d}')
+            ''')
+            self._partitions.add(partition)
+        return partition
+
+    async def save_results(self, results: Iterable[Tuple[str, int, int, int]]) -> None:
+        if not results:
+            return
+        check_time = datetime.now()
+        heartbeats = list(zip(*result_records(results, check_time, changed=False)))
+        try:
+            async with self.connection.get_cursor() as conn:
+                await self._ensure_partition(conn, check_time)
+                await conn.copy_records_to_table(self.table,
+                                                 records=result_records(results, check_time),
+                                                 columns=RESULT_COLUMNS,
+                                                 schema_name='public')
+                if heartbeats:
+                    await self._save_heartbeats(conn, *heartbeats[:4], check_time)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Error copying {len(results)} results to Postgres: {e}")
+            raise
+
+    async def _save_heartbeats(self, conn, urls, totals, with_tickets, without_tickets, check_time) -> None:
+        """
+        Неизменившиеся проверки увеличивают repeat_count последней строки сайта.
+
+        Если последняя строка сайта с другими значениями или ее нет (свернута
+        в агрегаты), проверка добавляется новой строкой.
+        """
+        await conn.execute(f'''
+            WITH heartbeats AS (
+                SELECT * FROM unnest($1::text[], $2::integer[], $3::integer[], $4::integer[])
+                    AS heartbeats(url, total_events_count, events_with_tickets_count, events_without_tickets_count)
+            ),
+            latest AS (
+                SELECT heartbeats.*, last.tableoid AS last_tableoid, last.ctid AS last_ctid
+                FROM heartbeats
+                CROSS JOIN LATERAL (
+                    SELECT tableoid, ctid, total_events_count, events_with_tickets_count, events_without_tickets_count
+                    FROM public.{self.table}
+                    WHERE url = heartbeats.url
+                    ORDER BY check_time DESC
+                    LIMIT 1
+                ) AS last
+                WHERE last.total_events_count = heartbeats.total_events_count
+                  AND last.events_with_tickets_count = heartbeats.events_with_tickets_count
+                  AND last.events_without_tickets_count = heartbeats.events_without_tickets_count
+            ),
+            updated AS (
+                UPDATE public.{self.table} AS results
+                SET repeat_count = results.repeat_count + 1, last_seen = $5
+                FROM latest
+                WHERE results.tableoid = latest.last_tableoid AND results.ctid = latest.last_ctid
+                RETURNING results.url
+            )
+            INSERT INTO public.{self.table} ({', '.join(RESULT_COLUMNS)})
+            SELECT url, total_events_count, events_with_tickets_count, events_without_tickets_count, $5
+            FROM heartbeats
+            WHERE url NOT IN (SELECT url FROM updated)
+        ''', urls, totals, with_tickets, without_tickets, check_time)
+
+    async def load_history(self, urls: Iterable[str], limit=10) -> Dict[str, List[Tuple[int, int]]]:
+        history: Dict[str, List[Tuple[int, int]]] = {}
+        async with self.connection.get_cursor() as conn:
+            # LATERAL читает по индексу только последние limit строк каждого сайта
+            # Каждая строка - хотя бы одна проверка, поэтому limit строк на сайт достаточно
+            rows = await conn.fetch(f'''
+                SELECT sites.url, results.events_with_tickets_count, results.total_events_count,
+                       results.repeat_count
+                FROM unnest($1::text[]) AS sites(url)
+                CROSS JOIN LATERAL (
+                    SELECT events_with_tickets_count, total_events_count, repeat_count, check_time
+                    FROM public.{self.table}
+                    WHERE url = sites.url
+                    ORDER BY check_time DESC
+                    LIMIT $2
+                ) AS results
+                ORDER BY sites.url, results.check_time DESC
+            ''', list(urls), limit)
+        url_rows: Dict[str, List[Tuple[int, int, int]]] = {}
+        for row in rows:
+            url_rows.setdefault(row['url'], []).append((row['events_with_tickets_count'],
+                                                        row['total_events_count'],
+                                                        row['repeat_count']))
+        for url, samples in url_rows.items():
+            history[url] = expand_repeats(samples, limit)
+        return history
+
+    async def compact_chunk(self, cutoff: datetime, limit=COMPACT_CHUNK_ROWS) -> int:
+        async with self.connection.get_cursor() as conn:
+            oldest = await conn.fetchval(f'SELECT MIN(check_time) FROM public.{self.table}')
+            if oldest is None:
+                return 0
+            start = hour_bucket(oldest)
+            end = start + timedelta(hours=1)
+            if end > cutoff:
+                return 0
+            # Удаление и пополнение агрегатов - один оператор: строки, которые параллельно
+            # сворачивает другой экземпляр, заблокированы и сюда не попадут, поэтому
+            # агрегаты не считаются дважды
+            inserts = ''.join(f''',
+                {period} AS (
+                    INSERT INTO public.{self.table}_{period}
+                        (url, bucket, min_percentage, max_percentage, sum_percentage, sample_count)
+                    SELECT url, {bucket}, min_percentage, max_percentage, sum_percentage, sample_count
+                    FROM samples
+                    ON CONFLICT (url, bucket) DO UPDATE SET
+                        min_percentage = LEAST(public.{self.table}_{period}.min_percentage, excluded.min_percentage),
+                        max_percentage = GREATEST(public.{self.table}_{period}.max_percentage, excluded.max_percentage),
+                        sum_percentage = public.{self.table}_{period}.sum_percentage + excluded.sum_percentage,
+                        sample_count = public.{self.table}_{period}.sample_count + excluded.sample_count
+                )''' for period, bucket in (('hourly', '$1::timestamp'), ('daily', '$2::timestamp')))
+            return await conn.fetchval(f'''
+                WITH moved AS (
+                    DELETE FROM public.{self.table}
+                    WHERE (tableoid, ctid) IN (
+                        SELECT tableoid, ctid FROM public.{self.table}
+                        WHERE check_time >= $1 AND check_time < $3
+                        LIMIT $4
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING url,
+                              CASE WHEN total_events_count > 0
+                                   THEN events_with_tickets_count * 100.0 / total_events_count
+                                   ELSE 0 END AS percentage,
+                              repeat_count + 1 AS repeats
+                ),
+                samples AS (
+                    SELECT url,
+                           MIN(percentage) AS min_percentage,
+                           MAX(percentage) AS max_percentage,
+                           SUM(percentage * repeats) AS sum_percentage,
+                           SUM(repeats) AS sample_count
+                    FROM moved
+                    GROUP BY url
+                ){inserts}
+                SELECT COUNT(*) FROM moved
+            ''', start, day_bucket(start), end, limit)
+
+    async def prune_rollups(self, cutoff: datetime, period='hourly') -> int:
+        if period not in ROLLUP_PERIODS:
+            raise ValueError(f"Unknown rollup period: {period}")
+        async with self.connection.get_cursor() as conn:
+            status = await conn.execute(f'DELETE FROM public.{self.table}_{period} WHERE bucket < $1', cutoff)
+        return int(status.split()[-1])
+
+    async def get_rollups(self, urls: Iterable[str], period='daily', limit=30
+                          ) -> Dict[str, List[Tuple[float, float, float, int]]]:
+        if period not in ROLLUP_PERIODS:
+            raise ValueError(f"Unknown rollup period: {period}")
+        async with self.connection.get_cursor() as conn:
+            rows = await conn.fetch(f'''
+                SELECT sites.url, rollups.min_percentage, rollups.max_percentage,
+                       rollups.mean_percentage, rollups.sample_count
+                FROM unnest($1::text[]) AS sites(url)
+                CROSS JOIN LATERAL (
+                    SELECT min_percentage, max_percentage, sum_percentage / sample_count AS mean_percentage,
+                           sample_count, bucket
+                    FROM public.{self.table}_{period}
+                    WHERE url = sites.url
+                    ORDER BY bucket DESC
+                    LIMIT $2
+                ) AS rollups
+                ORDER BY sites.url, rollups.bucket DESC
+            ''', list(urls), limit)
+        rollups: Dict[str, List[Tuple[float, float, float, int]]] = {}
+        for row in rows:
+            rollups.setdefault(row['url'], []).append(tuple(row)[1:])
+        return rollups
+
+    async def close(self) -> None:
+        # Пул принадлежит DBConnection и закрывается вместе с ним
+        pass
@@ -1,18 +1,38 @@
 import os
 import json
+import hashlib
 import aiofiles
+from collections import namedtuple
 from typing import List
 
+# message_id части сводки в канале и хэш текста, с которым она была отправлена
+MessagePart = namedtuple('MessagePart', ['message_id', 'content_hash'])
+
 filename_default = os.path.join(os.path.dirname(__file__), 'message_ids.json')
-async def save_message_ids(message_ids: List[int],
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+async def save_message_ids(message_parts: List[MessagePart],
                            filename=filename_default):
+    data = [{'message_id': part.message_id, 'hash': part.content_hash}
+            for part in message_parts]
     async with aiofiles.open(filename, 'w') as file:
-        await file.write(json.dumps(message_ids, indent=2))
+        await file.write(json.dumps(data, indent=2))
 
-async def load_message_ids(filename=filename_default) -> List[int]:
+async def load_message_ids(filename=filename_default) -> List[MessagePart]:
     try:
         async with aiofiles.open(filename, 'r') as file:
             data = json.loads(await file.read())
-            return data
     except FileNotFoundError:
         return []
+    message_parts = []
+    for item in data:
+        if isinstance(item, dict):
+            message_parts.append(MessagePart(item['message_id'], item.get('hash')))
+        else:
+            # Старый формат: список message_id без хэшей
+            message_parts.append(MessagePart(item, None))
+    return message_parts
@@ -1,2 +1,3 @@
-from .logger import logger
+from .logger import logger, set_log_file
 from .messages import EventMessage
+from .metrics import metrics
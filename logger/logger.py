@@ -1,17 +1,163 @@
 import os
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, List, Tuple
+
+# Размер буфера записей, ожидающих записи в файл; при переполнении записи отбрасываются
+LOG_QUEUE_SIZE = 10000
+# Одинаковые предупреждения и ошибки пишутся не чаще раза в DEDUP_INTERVAL секунд
+DEDUP_INTERVAL = 60
+DEDUP_MAX_KEYS = 1000
+# Сколько ждать места в очереди для записей, отложенных до закрытия
+CLOSE_TIMEOUT = 5
+
+
+class DedupQueueHandler(QueueHandler):
+    """
+    Передает записи в очередь, не выполняя файловый ввод-вывод в потоке вызова.
+
+    Повторы одинаковых предупреждений и ошибок в течение interval секунд
+    не попадают в очередь; по истечении окна пишется одна запись с
+    количеством пропущенных повторов. Записи, не поместившиеся в
+    переполненную очередь, считаются в dropped, и их количество пишется в
+    лог при следующей проверке окна и при закрытии обработчика.
+    """
+
+    def __init__(self, log_queue: queue.Queue, interval=DEDUP_INTERVAL, max_keys=DEDUP_MAX_KEYS):
+        super().__init__(log_queue)
+        self.interval = interval
+        self.max_keys = max_keys
+        self.dropped = 0
+        self._reported_dropped = 0
+        # При закрытии отложенные записи ждут места в очереди, а не отбрасываются
+        self._closing = False
+        # (уровень, текст) -> [время первой записи в окне, количество пропущенных повторов, запись]
+        self._seen: Dict[Tuple[int, str], List] = {}
+        self._last_sweep = time.monotonic()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep >= self.interval:
+            self._sweep(now)
+        if record.levelno >= logging.WARNING:
+            key = (record.levelno, record.getMessage())
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.interval:
+                seen[1] += 1
+                return
+            if seen is not None and seen[1]:
+                self._put(self._repeated_record(seen[2], seen[1]))
+            if len(self._seen) >= self.max_keys:
+                self._sweep(now, force=True)
+            self._seen[key] = [now, 0, record]
+        self._put(record)
+
+    def _sweep(self, now: float, force=False) -> None:
+        self._last_sweep = now
+        for key, (first_seen, repeated, record) in list(self._seen.items()):
+            if force or now - first_seen >= self.interval:
+                del self._seen[key]
+                if repeated:
+                    self._put(self._repeated_record(record, repeated))
+        self._report_dropped()
+
+    def _report_dropped(self) -> None:
+        dropped = self.dropped - self._reported_dropped
+        if not dropped:
+            return
+        self._reported_dropped = self.dropped
+        self._put(logging.makeLogRecord({'name': logger.name,
+                                         'levelno': logging.WARNING,
+                                         'levelname': 'WARNING',
+                                         'msg': f"Log queue was full, dropped {dropped} records"}))
+
+    def close(self) -> None:
+        """Записывает отложенные счетчики повторов и потерянных записей."""
+        self.acquire()
+        try:
+            self._closing = True
+            self._sweep(time.monotonic(), force=True)
+        finally:
+            self.release()
+        super().close()
+
+    def _repeated_record(self, record: logging.LogRecord, repeated: int) -> logging.LogRecord:
+        return logging.makeLogRecord({'name': record.name,
+                                      'levelno': record.levelno,
+                                      'levelname': record.levelname,
+                                      'msg': f"{record.getMessage()} (repeated {repeated} more times)"})
+
+    def _put(self, record: logging.LogRecord) -> None:
+        try:
+            if self._closing:
+                self.queue.put(self.prepare(record), timeout=CLOSE_TIMEOUT)
+            else:
+                self.enqueue(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Маркер остановки ждет места в заполненной очереди, иначе stop() падает с queue.Full
+        self.queue.put(self._sentinel)
+
 
 # Настройка логгера
 logger = logging.getLogger("checkeventsbot")
 logger.setLevel(logging.INFO)
-log_dir = os.path.join(os.path.dirname(__file__), 'checkevents.log')
-# Обработчик для записи логов в файл с ротацией каждые 5 дней
-file_handler = TimedRotatingFileHandler(log_dir,
-                                        when="D",
-                                        interval=5,
-                                        backupCount=0)
-file_handler.setLevel(logging.INFO)
+# LOG_FILE переопределяет путь (например, бенчмарк пишет во временный каталог)
+log_dir = os.getenv('LOG_FILE') or os.path.join(os.path.dirname(__file__), 'checkevents.log')
 file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
\ No newline at end of file
+
+
+def _create_file_handler(path: str) -> TimedRotatingFileHandler:
+    # Обработчик для записи логов в файл с ротацией каждые 5 дней
+    handler = TimedRotatingFileHandler(path,
+                                       when="D",
+                                       interval=5,
+                                       backupCount=0)
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(file_formatter)
+    return handler
+
+
+file_handler = _create_file_handler(log_dir)
+# Запись в файл и ротация выполняются в потоке QueueListener, а не в цикле событий
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = DedupQueueHandler(log_queue)
+logger.addHandler(queue_handler)
+log_listener = DrainingQueueListener(log_queue, file_handler, respect_handler_level=True)
+log_listener.start()
+
+
+def _shutdown() -> None:
+    # Сначала отложенные записи обработчика, потом остановка потока, который их пишет
+    queue_handler.close()
+    if log_listener._thread is not None:
+        log_listener.stop()
+
+
+atexit.register(_shutdown)
+
+
+def set_log_file(suffix: str) -> None:
+    """
+    Переключает запись логов на отдельный файл: checkevents.log -> checkevents.<suffix>.log.
+
+    Нужно процессам воркеров: ротация одного файла из нескольких процессов
+    теряет записи. Вызывается до первой записи в лог.
+    """
+    global file_handler
+    base, extension = os.path.splitext(log_dir)
+    handler = _create_file_handler(f"{base}.{suffix}{extension}")
+    log_listener.stop()
+    file_handler.close()
+    file_handler = handler
+    log_listener.handlers = (handler,)
+    log_listener.start()
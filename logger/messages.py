@@ -1,9 +1,15 @@
+from bisect import bisect_right
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Optional
 from collections import namedtuple
 
 MAX_MESSAGE_LENGTH = 4076
+# Части заполняются не до конца, чтобы рост строки сайта не сдвигал соседние части
+PART_FILL_RATIO = 0.85
+# Запас под строку времени последней проверки в каждой части
+FOOTER_RESERVE = 64
+FOOTER_PREFIX = "\n➖ Последняя проверка: "
 
 
 @dataclass
@@ -11,13 +17,25 @@ class EventMessage:
     header: str = "📈 **Результаты проверки мероприятий** 📈\n\n"
     body: List[str] = field(default_factory=list)
     notifications: List[str] = field(default_factory=list)
-    messages: List[Tuple[str, str]] = field(default_factory=list)
+    messages: Dict[str, str] = field(default_factory=dict)
+    _parts: Optional[List[str]] = field(default=None, init=False, repr=False)
+    # Первый сайт каждой части, кроме первой; задает стабильное разбиение по частям
+    _boundaries: Optional[List[str]] = field(default=None, init=False, repr=False)
 
     @property
     def check_time(self):
         return datetime.now().strftime('%d %B %H:%M')
 
     def add(self, site_info: namedtuple, percentage_with_tickets: float) -> None:
+        self.add_line(site_info.site_name,
+                      site_info.events_with_tickets_count,
+                      site_info.total_events_count,
+                      percentage_with_tickets)
+
+    def add_line(self, site_name: str,
+                 events_with_tickets_count: int,
+                 total_events_count: int,
+                 percentage_with_tickets: float) -> None:
         if percentage_with_tickets > 60:
             icon = "🟢"
         elif 50 < percentage_with_tickets <= 60:
@@ -29,11 +47,11 @@ class EventMessage:
         else:
             icon = "🔴"
         new_message = (
-            f"{icon} {site_info.site_name}"
-            f" ➖ {site_info.events_with_tickets_count}"
-            f" ({percentage_with_tickets:.0f}%) из {site_info.total_events_count}\n"
+            f"{icon} {site_name}"
+            f" ➖ {events_with_tickets_count}"
+            f" ({percentage_with_tickets:.0f}%) из {total_events_count}\n"
         )
-        self._add_to_messages(site_info.site_name, new_message)
+        self._add_to_messages(site_name, new_message)
 
     def add_warning(self, site_name: str,
                     percentage_drop: float,
@@ -67,8 +85,49 @@ class EventMessage:
         else:
             self._add_to_notifications(available_ticket_message)
 
+    def add_alert(self, text: str, need_return=False):
+        alert_message = f"{text}\nВремя проверки: {self.check_time}\n"
+        if need_return:
+            return alert_message
+        else:
+            self._add_to_notifications(alert_message)
+
+    def retain(self, site_names: Iterable[str]) -> bool:
+        """
+        Удаляет строки сайтов, которых больше нет в списке.
+
+        :return: True, если что-то было удалено
+        """
+        removed = self.messages.keys() - set(site_names)
+        for site_name in removed:
+            del self.messages[site_name]
+        if removed:
+            self._parts = None
+        return bool(removed)
+
+    def merge_lines(self, lines: Dict[str, str], removed: Iterable[str] = ()) -> bool:
+        """
+        Принимает готовые строки сайтов от воркера.
+
+        :return: True, если сводка изменилась
+        """
+        changed = False
+        for site_name, line in lines.items():
+            if self.messages.get(site_name) != line:
+                self.messages[site_name] = line
+                changed = True
+        for site_name in removed:
+            if self.messages.pop(site_name, None) is not None:
+                changed = True
+        if changed:
+            self._parts = None
+        return changed
+
     def _add_to_messages(self, site_name: str, new_message: str):
-        self.messages.append((site_name, new_message))
+        # Строка сайта заменяется при каждой новой проверке
+        if self.messages.get(site_name) != new_message:
+            self.messages[site_name] = new_message
+            self._parts = None
 
     def _add_to_notifications(self, new_message: str):
         if (not self.notifications
@@ -76,43 +135,114 @@ class EventMessage:
             self.notifications.append(new_message)
         else:
             self.notifications[-1] += new_message
+        self._parts = None
 
     @property
     def message(self):
-        sorted_messages = sorted(self.messages, key=lambda x: x[0])
-        sorted_body = [message for _, message in sorted_messages]
+        sorted_body = [self.messages[site_name] for site_name in sorted(self.messages)]
         full_message = self.header + "".join(sorted_body)
         if self.notifications:
             full_message += "\n".join(self.notifications)
-        full_message += f"\n➖ Последняя проверка: {self.check_time}\n"
+        full_message += self._footer()
         return full_message
         # f"\n\nПоследняя проверка: {self.check_time}\n"
 
     @property
-    def message_parts(self):
+    def message_parts(self) -> List[str]:
+        """
+        Части сводки, каждая не длиннее MAX_MESSAGE_LENGTH.
+
+        Рендерятся один раз и кэшируются до изменения содержимого, поэтому
+        время проверки во всех обращениях одинаковое; обновить его без
+        изменения содержимого можно через refresh_check_time.
+        """
+        if self._parts is None:
+            self._parts = self._render_parts()
+        return self._parts
+
+    def refresh_check_time(self) -> None:
+        """
+        Обновляет время последней проверки в кэшированных частях.
+
+        Меняется только последняя часть, поэтому при синхронизации по хэшам
+        правится одно сообщение.
+        """
+        if self._parts is None:
+            return
+        last_part = self._parts[-1]
+        index = last_part.rfind(FOOTER_PREFIX)
+        refreshed = last_part[:index] + self._footer()
+        if index < 0 or len(refreshed) > MAX_MESSAGE_LENGTH:
+            self._parts = None
+        else:
+            self._parts[-1] = refreshed
+
+    def _footer(self) -> str:
+        return f"{FOOTER_PREFIX}{self.check_time}\n"
+
+    def _render_parts(self) -> List[str]:
+        sorted_names = sorted(self.messages)
+        groups = self._group_by_boundaries(sorted_names)
+        if groups is None:
+            groups = self._paginate(sorted_names)
+
         parts = []
-        current_part = self.header
-        sorted_messages = sorted(self.messages, key=lambda x: x[0])
-        sorted_body = [message for _, message in sorted_messages]
-        check_time_str = f"\n➖ Последняя проверка: {self.check_time}\n"
-
-        for section in sorted_body + self.notifications:
-            if (len(current_part) +
-                    len(section) +
-                    len(check_time_str) >
-                    MAX_MESSAGE_LENGTH):
+        for index, group in enumerate(groups):
+            sections = [self.header] if index == 0 else []
+            sections.extend(self.messages[site_name] for site_name in group)
+            parts.append(sections)
+
+        # Уведомления и время проверки добавляются в конец последней части
+        check_time_str = self._footer()
+        current_part = parts.pop()
+        current_length = sum(map(len, current_part))
+        for section in self.notifications:
+            if current_length + len(section) + len(check_time_str) > MAX_MESSAGE_LENGTH:
                 parts.append(current_part)
-                current_part = section
+                current_part = [section]
+                current_length = len(section)
             else:
-                current_part += section
-
-        if len(current_part) + len(check_time_str) <= MAX_MESSAGE_LENGTH:
-            current_part += check_time_str
+                current_part.append(section)
+                current_length += len(section)
+        if current_length + len(check_time_str) <= MAX_MESSAGE_LENGTH:
+            current_part.append(check_time_str)
         else:
             parts.append(current_part)
-            current_part = check_time_str
+            current_part = [check_time_str]
+        parts.append(current_part)
 
-        if current_part:
-            parts.append(current_part)
+        return ["".join(sections) for sections in parts]
+
+    def _group_by_boundaries(self, sorted_names: List[str]) -> Optional[List[List[str]]]:
+        """
+        Раскладывает сайты по частям прошлого разбиения.
+
+        :return: Группы сайтов или None, если разбиение пора пересчитать
+        """
+        if self._boundaries is None:
+            return None
+        groups = [[] for _ in range(len(self._boundaries) + 1)]
+        lengths = [len(self.header)] + [0] * len(self._boundaries)
+        for site_name in sorted_names:
+            index = bisect_right(self._boundaries, site_name)
+            groups[index].append(site_name)
+            lengths[index] += len(self.messages[site_name])
+        if len(groups) > 1 and not all(groups):
+            return None
+        if any(length > MAX_MESSAGE_LENGTH - FOOTER_RESERVE for length in lengths):
+            return None
+        return groups
 
-        return parts
+    def _paginate(self, sorted_names: List[str]) -> List[List[str]]:
+        capacity = int(MAX_MESSAGE_LENGTH * PART_FILL_RATIO) - FOOTER_RESERVE
+        groups = [[]]
+        current_length = len(self.header)
+        for site_name in sorted_names:
+            message_length = len(self.messages[site_name])
+            if groups[-1] and current_length + message_length > capacity:
+                groups.append([])
+                current_length = 0
+            groups[-1].append(site_name)
+            current_length += message_length
+        self._boundaries = [group[0] for group in groups[1:]]
+        return groups
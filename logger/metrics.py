@@ -0,0 +1,192 @@
+import time
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .logger import logger
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(value)}"
+                     for key, value in self._values.items())
+        return lines
+
+
+class Gauge:
+    """Значение, которое считывается функцией в момент запроса метрик."""
+
+    def __init__(self, name: str, help: str, func: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self) -> List[str]:
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.warning(f"Cannot read gauge {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам, сумма, количество]
+        self._series: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в формате Prometheus.
+
+    Длительности этапов цикла проверки копятся в гистограмме
+    stage_duration_seconds и в сводке текущего цикла, которая пишется в лог
+    одной строкой по окончании цикла.
+    """
+
+    def __init__(self, prefix='checkevents'):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self.stage_duration = self.histogram('stage_duration_seconds', 'Duration of check cycle stages')
+        self.cycle_duration = self.histogram('cycle_duration_seconds', 'Duration of whole check cycles')
+        self._cycle_started: Optional[float] = None
+        self._cycle_stages: Dict[str, float] = {}
+        self.last_cycle: Optional[dict] = None
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", help))
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", help, buckets))
+
+    def gauge(self, name: str, help: str, func: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}", help, func))
+
+    def _register(self, metric):
+        # Повторная регистрация возвращает уже существующую метрику
+        return self._metrics.setdefault(metric.name, metric)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - started)
+
+    def observe_stage(self, name: str, duration: float) -> None:
+        self.stage_duration.observe(duration, stage=name)
+        self._cycle_stages[name] = self._cycle_stages.get(name, 0.0) + duration
+
+    def start_cycle(self) -> None:
+        self._cycle_started = time.perf_counter()
+        self._cycle_stages = {}
+
+    def finish_cycle(self, **fields) -> dict:
+        """
+        Завершает цикл и пишет его сводку в лог.
+
+        :param fields: Дополнительные поля сводки (например, количество сайтов)
+        """
+        duration = time.perf_counter() - self._cycle_started if self._cycle_started else 0.0
+        self.cycle_duration.observe(duration)
+        record = {'duration': round(duration, 3),
+                  **{stage: round(value, 3) for stage, value in self._cycle_stages.items()},
+                  **fields}
+        self.last_cycle = record
+        self._cycle_started = None
+        logger.info("Cycle summary: " + " ".join(f"{key}={value}" for key, value in record.items()))
+        return record
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host='127.0.0.1', port=9108) -> asyncio.AbstractServer:
+        """Запускает HTTP-эндпоинт /metrics в текущем цикле событий."""
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                request_line = await reader.readline()
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                parts = request_line.decode('latin-1').split()
+                if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                    status, body = '200 OK', self.render().encode()
+                else:
+                    status, body = '404 Not Found', b'Not Found\n'
+                writer.write(f"HTTP/1.1 {status}\r\n"
+                             f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                             f"Content-Length: {len(body)}\r\n"
+                             f"Connection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+            except Exception as e:
+                logger.warning(f"Error serving metrics: {e}")
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logger.info(f"Metrics are served on http://{host}:{port}/metrics")
+        return server
+
+
+metrics = MetricsRegistry()
@@ -1,125 +1,586 @@
 import asyncio
-from collections import namedtuple
 from dotenv import load_dotenv
 import os
+import multiprocessing
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
-from database import (init_db,
-                      get_previous_results)
-from request import check_events
+import numpy as np
+
+from request import (iter_events, close_client, set_recorder, commit_fingerprints, retain_fingerprints,
+                     PollScheduler, ResponseRecorder)
 from telegram import (telegram_bot,
                       SendTask)
-from database import (save_site_result_to_db,
+from database import (DATABASE,
+                      SQLiteStore,
+                      ResultsBackend,
+                      PostgresResultsBackend,
+                      HistoryCache,
+                      RollupCompactor,
+                      Outbox,
+                      MessagePart,
+                      content_hash,
                       load_message_ids,
                       save_message_ids,
                       DBConnection)
-from logger import logger, EventMessage
-from calculate import (calculate_percentage,
-                       calculate_average_percentage,
-                       calculate_percentage_drop,
-                       were_tickets_available)
+from logger import logger, metrics, set_log_file, EventMessage
+from shard import HashRing, AggregatorServer, AggregatorClient
+from calculate import (DROP_THRESHOLD,
+                       CURRENT_THRESHOLD,
+                       BatchEvaluation,
+                       CycleResults,
+                       RuleContext,
+                       FiredAlert,
+                       HistorySummary,
+                       evaluate_batch,
+                       load_rules)
 
 load_dotenv()
 
 DOMAIN = os.getenv('DOMAIN')
 CHECK_INTERVAL = 800
+MIN_CHECK_INTERVAL = 200
+MAX_CHECK_INTERVAL = 7200
+# Сайты, срок проверки которых наступает в пределах окна, проверяются одной пачкой
+POLL_WINDOW = 60
+SITES_REFRESH_INTERVAL = 60
+HISTORY_LIMIT = 10
+# Сырые проверки старше RAW_RETENTION_DAYS сворачиваются в почасовые и дневные агрегаты
+RAW_RETENTION_DAYS = int(os.getenv('RAW_RETENTION_DAYS', 14))
+HOURLY_RETENTION_DAYS = int(os.getenv('HOURLY_RETENTION_DAYS', 180))
+# sqlite - локальный файл, postgres - общая история для нескольких экземпляров
+RESULTS_BACKEND = os.getenv('RESULTS_BACKEND', 'sqlite')
+ANALYSIS_BATCH_SIZE = 200
+ANALYSIS_FLUSH_INTERVAL = 5
+# Шардирование: '' - один процесс, 'aggregator' - сводка и Telegram, 'worker' - проверки своего шарда
+SHARD_MODE = os.getenv('SHARD_MODE', '')
+# Идентификаторы всех воркеров через запятую, одинаковые на всех узлах
+SHARD_WORKERS = os.getenv('SHARD_WORKERS', '')
+# Сколько воркеров агрегатор запускает сам на этой машине
+SHARD_LOCAL_WORKERS = int(os.getenv('SHARD_LOCAL_WORKERS', 0))
+WORKER_ID = os.getenv('WORKER_ID', '')
+AGGREGATOR_HOST = os.getenv('AGGREGATOR_HOST', '127.0.0.1')
+AGGREGATOR_PORT = int(os.getenv('AGGREGATOR_PORT', 8765))
+SUMMARY_DEBOUNCE = 5
+# Эндпоинт /metrics в формате Prometheus; 0 - выключен
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+# Правила уведомлений в JSON (см. calculate/rules.py); без переменной берется alert_rules.json,
+# если он есть, иначе правила по умолчанию
+ALERT_RULES_PATH = os.getenv('ALERT_RULES_PATH') or ('alert_rules.json' if os.path.exists('alert_rules.json') else None)
+# Файл для записи ответов API (для backtest.py); пусто - не записывать
+RECORD_PATH = os.getenv('RECORD_PATH', '')
 BASE_URL = f"http://{DOMAIN}/react_api/v1/check_ticket_availability"
-EventResult = namedtuple('EventResult', ['site_name', 'total_events_count',
-                                         'events_with_tickets_count', 'events_without_tickets_count'])
+sites_checked = metrics.counter('sites_checked_total', 'Sites checked by the scheduler')
+alerts_fired = metrics.counter('alerts_fired_total', 'Alerts fired by rule')
+# Правила компилируются один раз при запуске
+alert_rules = load_rules(ALERT_RULES_PATH)
 
 
-async def scheduled_check():
-    await init_db()
-    db_connection = DBConnection(logger=logger,
-                                 use_json=False)
-    message_ids: list = await load_message_ids()
+def evaluate_cycle(cycle: CycleResults,
+                   history: HistoryCache,
+                   rows: np.ndarray,
+                   changed: Optional[List[bool]] = None) -> Tuple[BatchEvaluation, List[FiredAlert]]:
+    """
+    :param rows: Строки сайтов cycle в history
+    :param changed: Какие сайты изменились, если cycle содержит и неизменившиеся (для правил every_sample)
+    """
+    with metrics.stage('history'):
+        history_with_tickets, history_total, history_length = history.history(rows)
+    with metrics.stage('analysis'):
+        # Столбцы читаются без копирования; evaluate_batch не сохраняет ссылки на них
+        evaluation = evaluate_batch(
+            cycle.column('events_with_tickets_count'),
+            cycle.column('total_events_count'),
+            history_with_tickets,
+            history_total,
+            history_length,
+            baselines=history.baselines[rows]
+        )
+        alerts = alert_rules.evaluate(cycle.site_names,
+                                      RuleContext(evaluation, history_with_tickets, history_total, history_length),
+                                      now=time.time(),
+                                      changed=changed)
+    return evaluation, alerts
+
+
+def format_alert(fired: FiredAlert, evaluation: BatchEvaluation, message_for_tg: EventMessage) -> str:
+    index = fired.index
+    text = fired.rule.format(fired.site_name, evaluation, index)
+    if text is not None:
+        return message_for_tg.add_alert(text, need_return=True)
+    if fired.rule.type == 'reappearance':
+        return message_for_tg.add_available_ticket(fired.site_name,
+                                                   evaluation.percentages[index],
+                                                   evaluation.last_percentages[index],
+                                                   need_return=True)
+    return message_for_tg.add_warning(fired.site_name,
+                                      evaluation.drops[index],
+                                      evaluation.averages[index],
+                                      evaluation.percentages[index],
+                                      need_return=True)
+
+
+def is_near_threshold(percentage_with_tickets: float, percentage_drop: float) -> bool:
+    return (percentage_drop > DROP_THRESHOLD / 2 or
+            0 < percentage_with_tickets < CURRENT_THRESHOLD * 2)
+
+
+async def send_alert(message: str) -> None:
+    await telegram_bot.add_to_queue(
+        SendTask(type='send', message=message, chat_id=telegram_bot.CHANNEL_WARNING),
+        durable=True
+    )
+
+
+def reschedule_unchanged(site_name: str,
+                         index: int,
+                         summary: HistorySummary,
+                         scheduler: PollScheduler) -> None:
+    """:param index: Номер сайта в summary"""
+    if summary.has_history[index]:
+        last_percentage = summary.last_percentages[index]
+        scheduler.update_interval(site_name,
+                                  changed=False,
+                                  volatility=summary.stds[index],
+                                  near_threshold=is_near_threshold(last_percentage,
+                                                                   summary.averages[index] - last_percentage))
+    scheduler.reschedule(site_name)
+
+
+async def process_results(cycle: CycleResults,
+                          history: HistoryCache,
+                          results_backend: ResultsBackend,
+                          scheduler: PollScheduler,
+                          message_for_tg: EventMessage,
+                          alert: Callable[[str], Awaitable[None]] = None) -> bool:
+    """
+    Анализирует и сохраняет порцию результатов.
+
+    Сайты, ответ которых не изменился с прошлой проверки, не анализируются
+    и не меняют сводку: обновляется только их история и интервал опроса.
+    Если среди правил есть правила с every_sample, такие сайты проверяются
+    только этими правилами. Неизменившиеся проверки сохраняются повтором
+    последней строки сайта (repeat_count), чтобы окно истории после
+    перезапуска и в backtest.py --database совпадало с окном в памяти.
+
+    :param alert: Отправляет предупреждение; по умолчанию в канал предупреждений
+    :return: True, если сводка в Telegram изменилась
+    """
+    alert = alert or send_alert
+    every_sample = alert_rules.every_sample
+    rows = history.rows(cycle.site_names)
+    # Окно истории до текущих проверок: по нему пересчитываются интервалы опроса
+    summary = history.summary(rows)
+    evaluated_indices = []
+    changed = []
+    for index, (site_name, _, _, _, site_changed) in enumerate(cycle):
+        # Сайт без строки в сводке (например, снова включенный) обрабатывается полностью
+        site_changed = site_changed or site_name not in message_for_tg.messages
+        if site_changed or every_sample:
+            evaluated_indices.append(index)
+            changed.append(site_changed)
+            continue
+        reschedule_unchanged(site_name, index, summary, scheduler)
+
+    if evaluated_indices:
+        if len(evaluated_indices) == len(cycle):
+            evaluated, evaluated_rows = cycle, rows
+        else:
+            evaluated, evaluated_rows = cycle.take(evaluated_indices), rows[evaluated_indices]
+        evaluation, fired_alerts = evaluate_cycle(evaluated, history, evaluated_rows,
+                                                  changed if every_sample else None)
+        alerts_by_site: Dict[int, List[FiredAlert]] = {}
+        for fired in fired_alerts:
+            alerts_by_site.setdefault(fired.index, []).append(fired)
+
+        for index, (site_name, total_events_count, events_with_tickets_count, _, _) in enumerate(evaluated):
+            for fired in alerts_by_site.get(index, ()):
+                alerts_fired.inc(rule=fired.rule.name)
+                await alert(format_alert(fired, evaluation, message_for_tg))
+
+            cycle_index = evaluated_indices[index]
+            if not changed[index]:
+                reschedule_unchanged(site_name, cycle_index, summary, scheduler)
+                continue
+            percentage_with_tickets = evaluation.percentages[index]
+            message_for_tg.add_line(site_name, events_with_tickets_count, total_events_count, percentage_with_tickets)
+
+            sample_changed = (not summary.has_history[cycle_index] or
+                              summary.last_with_tickets[cycle_index] != events_with_tickets_count or
+                              summary.last_total[cycle_index] != total_events_count)
+            near_threshold = (bool(evaluation.has_history[index]) and
+                              is_near_threshold(percentage_with_tickets, evaluation.drops[index]))
+            scheduler.update_interval(site_name,
+                                      changed=bool(sample_changed),
+                                      volatility=summary.stds[cycle_index],
+                                      near_threshold=near_threshold)
+            scheduler.reschedule(site_name)
+
+    with metrics.stage('history'):
+        history.add(rows, cycle.column('events_with_tickets_count'), cycle.column('total_events_count'))
+    await save_cycle(cycle, results_backend)
+    return any(changed)
+
+
+async def save_cycle(cycle: CycleResults, results_backend: ResultsBackend) -> None:
+    with metrics.stage('db_write'):
+        await results_backend.save_results(cycle)
+
+
+async def update_summary(message_for_tg: EventMessage, message_parts: List[MessagePart]) -> List[MessagePart]:
+    """
+    Синхронизирует сводку в канале с текущими частями сообщения.
+
+    Редактируются только части, текст которых изменился с прошлой отправки.
+
+    :param message_parts: Сохраненные message_id и хэши частей
+    :return: Обновленный список message_id и хэшей
+    """
+    with metrics.stage('render'):
+        parts = message_for_tg.message_parts
+    with metrics.stage('telegram'):
+        return await sync_summary_parts(parts, message_parts)
+
+
+async def sync_summary_parts(parts: List[str], message_parts: List[MessagePart]) -> List[MessagePart]:
+    """Отправляет, правит и удаляет сообщения сводки в канале."""
+    if not message_parts:
+        # Если нет сохраненных message_id, очищаем канал и отправляем сводку заново
+        await telegram_bot.tg_delete_messages(telegram_bot.CHANNEL_INFO)
+    elif len(parts) < len(message_parts):
+        # Если частей сообщений меньше, чем сохраненных message_id, удаляем лишние сообщения
+        await telegram_bot.tg_delete_messages_by_id(
+            telegram_bot.CHANNEL_INFO,
+            [message_part.message_id for message_part in message_parts[len(parts):]]
+        )
+        message_parts = message_parts[:len(parts)]
+
+    # Все правки и отправки ставятся в очередь сразу: диспетчер схлопывает
+    # повторные правки одного сообщения и соблюдает лимиты канала
+    async def sync_part(index: int, part: str) -> MessagePart:
+        part_hash = content_hash(part)
+        stored = message_parts[index] if index < len(message_parts) else None
+        if stored is not None and stored.message_id is not None:
+            if stored.content_hash == part_hash:
+                return stored
+            edit_message_id = await telegram_bot.tg_edit_message(telegram_bot.CHANNEL_INFO,
+                                                                 stored.message_id,
+                                                                 part)
+            if edit_message_id is None:
+                # Правка не удалась: старый хэш заставит повторить ее при следующей синхронизации
+                return stored
+            return MessagePart(edit_message_id, part_hash)
+        message_id = await telegram_bot.tg_send_message(telegram_bot.CHANNEL_INFO, part)
+        return MessagePart(message_id, part_hash if message_id else None)
+
+    return list(await asyncio.gather(*(sync_part(index, part) for index, part in enumerate(parts))))
+
+
+def worker_database(worker_id: str) -> str:
+    """Отдельный файл SQLite воркера: database/events.db -> database/events.worker-0.db."""
+    base, extension = os.path.splitext(DATABASE)
+    return f"{base}.{worker_id}{extension}"
+
+
+async def create_results_backend(db_connection: DBConnection, worker_id: str = '') -> ResultsBackend:
+    if RESULTS_BACKEND == 'postgres':
+        results_backend = PostgresResultsBackend(db_connection, logger=logger)
+    elif worker_id:
+        # Воркеры на одной машине не должны делить файл базы ни друг с другом, ни с агрегатором
+        results_backend = SQLiteStore(database=worker_database(worker_id), logger=logger)
+    else:
+        results_backend = SQLiteStore(logger=logger)
+    await results_backend.init_db()
+    return results_backend
+
+
+def start_compaction(results_backend: ResultsBackend) -> None:
+    compactor = RollupCompactor(results_backend,
+                                raw_retention=timedelta(days=RAW_RETENTION_DAYS),
+                                hourly_retention=timedelta(days=HOURLY_RETENTION_DAYS),
+                                logger=logger)
+    asyncio.create_task(compactor.run())
+
+
+async def start_telegram(sqlite_store: SQLiteStore) -> None:
+    outbox = Outbox(sqlite_store, logger=logger)
+    await outbox.init_db()
+    await telegram_bot.start_outbox(outbox)
     asyncio.create_task(telegram_bot.start_polling())
 
+
+async def check_sites(site_names: List[str],
+                      history: HistoryCache,
+                      results_backend: ResultsBackend,
+                      scheduler: PollScheduler,
+                      message_for_tg: EventMessage,
+                      alert: Callable[[str], Awaitable[None]] = None) -> bool:
+    """
+    Проверяет сайты и обрабатывает результаты порциями, пока остальные запросы еще выполняются.
+
+    :return: True, если сводка в Telegram изменилась
+    """
+    summary_changed = False
+    # Один контейнер на весь проход: заполняется по мере ответов и очищается после обработки порции
+    chunk = CycleResults()
+    chunk_started = time.monotonic()
+    sweep_started = time.perf_counter()
+    processing_time = 0.0
+
+    async def process_chunk() -> bool:
+        nonlocal processing_time
+        started = time.perf_counter()
+        try:
+            chunk_changed = await process_results(chunk, history, results_backend, scheduler, message_for_tg, alert)
+            # Отпечатки запоминаются только после сохранения: иначе упавшая порция не попала бы в базу
+            commit_fingerprints(chunk.site_names)
+            return chunk_changed
+        finally:
+            chunk.clear()
+            processing_time += time.perf_counter() - started
+
+    async for result, error in iter_events(BASE_URL, site_names):
+        if error is not None:
+            logger.error(f"An error occurred: {error}")
+            scheduler.reschedule(error.site_name)
+            continue
+        if not chunk:
+            chunk_started = time.monotonic()
+        chunk.append(*result)
+        if (len(chunk) >= ANALYSIS_BATCH_SIZE or
+                time.monotonic() - chunk_started >= ANALYSIS_FLUSH_INTERVAL):
+            if await process_chunk():
+                summary_changed = True
+    if await process_chunk():
+        summary_changed = True
+    # Время обработки порций учитывается в своих этапах, здесь только ожидание ответов
+    metrics.observe_stage('http', time.perf_counter() - sweep_started - processing_time)
+    return summary_changed
+
+
+async def run_checks(get_site_names: Callable[[], Awaitable[List[str]]],
+                     results_backend: ResultsBackend,
+                     message_for_tg: EventMessage,
+                     publish: Callable[[bool], Awaitable[None]],
+                     alert: Callable[[str], Awaitable[None]] = None):
+    """
+    Цикл проверок: опрашивает сайты по расписанию, анализирует и сохраняет результаты.
+
+    :param get_site_names: Возвращает сайты, которые проверяет этот процесс
+    :param publish: Вызывается после каждой пачки проверок; аргумент - изменилась ли сводка
+    :param alert: Отправляет предупреждения
+    """
+    history = HistoryCache(limit=HISTORY_LIMIT)
+    scheduler = PollScheduler(base_interval=CHECK_INTERVAL,
+                              min_interval=MIN_CHECK_INTERVAL,
+                              max_interval=MAX_CHECK_INTERVAL)
+
     while True:
         try:
-            message_for_tg = EventMessage()
-            site_names = await db_connection.get_sites()
-            successful_requests, errors_requests = await check_events(BASE_URL, site_names)
-
-            for result in successful_requests:
-                site_info = EventResult(*result)
-                percentage_with_tickets = calculate_percentage(site_info)
-                message_for_tg.add(site_info, percentage_with_tickets)
-                previous_results = await get_previous_results(site_info.site_name, limit=10)
-
-                if previous_results:
-                    average_previous_percentage = calculate_average_percentage(previous_results)
-                    percentage_drop = calculate_percentage_drop(average_previous_percentage, percentage_with_tickets)
-                    if (percentage_drop > 10 and
-                            percentage_with_tickets < 9 and
-                            were_tickets_available(previous_results[:1])):
-                        message = message_for_tg.add_warning(site_info.site_name,
-                                                             percentage_drop,
-                                                             average_previous_percentage,
-                                                             percentage_with_tickets,
-                                                             need_return=True)
-                        await telegram_bot.add_to_queue(
-                            SendTask(type='send', message=message, chat_id=telegram_bot.CHANNEL_WARNING)
-                        )
-                    if percentage_with_tickets > 0 and not were_tickets_available(previous_results[:1]):
-                        initial_percentage = calculate_average_percentage(previous_results[:1])
-                        message = message_for_tg.add_available_ticket(site_info.site_name,
-                                                                      percentage_with_tickets,
-                                                                      initial_percentage,
-                                                                      need_return=True)
-                        await telegram_bot.add_to_queue(
-                            SendTask(type='send', message=message, chat_id=telegram_bot.CHANNEL_WARNING)
-                        )
-
-                await save_site_result_to_db(*site_info)
-
-            for error in errors_requests:
-                logger.error(f"An error occurred: {error}")
-
-            if message_ids:
-                if len(message_for_tg.message_parts) > len(message_ids):
-                    # Если частей сообщений больше, чем сохраненных message_id, добавляем новые сообщения
-                    for part, message_id in zip(message_for_tg.message_parts, message_ids):
-                        edit_message_id = await telegram_bot.tg_edit_message(telegram_bot.CHANNEL_INFO,
-                                                                             message_id,
-                                                                             part)
-                        if edit_message_id:
-                            message_ids.remove(message_id)
-                            message_ids.append(edit_message_id)
-                    for part in message_for_tg.message_parts[len(message_ids):]:
-                        message_id = await telegram_bot.tg_send_message(telegram_bot.CHANNEL_INFO, part)
-                        message_ids.append(message_id)
-                else:
-                    if len(message_for_tg.message_parts) < len(message_ids):
-                        # Если частей сообщений меньше, чем сохраненных message_id, удаляем лишние сообщения
-                        await telegram_bot.tg_delete_messages_by_id(
-                            telegram_bot.CHANNEL_INFO,
-                            message_ids[len(message_for_tg.message_parts):]
-                        )
-                        message_ids = message_ids[:len(message_for_tg.message_parts)]
-                    # Если частей сообщений меньше или равно количеству сохраненных message_id, обновляем существующие сообщения
-                    for message_id, part in zip(message_ids, message_for_tg.message_parts):
-                        edit_message_id = await telegram_bot.tg_edit_message(telegram_bot.CHANNEL_INFO,
-                                                                             message_id,
-                                                                             part)
-                        if edit_message_id:
-                            message_ids.remove(message_id)
-                            message_ids.append(edit_message_id)
-            else:
-                # Если нет сохраненных message_id, отправляем новые сообщения
-                await telegram_bot.tg_delete_messages(telegram_bot.CHANNEL_INFO)
-                for part in message_for_tg.message_parts:
-                    message_id = await telegram_bot.tg_send_message(telegram_bot.CHANNEL_INFO, part)
-                    message_ids.append(message_id)
-            await save_message_ids(message_ids)
-            await asyncio.sleep(CHECK_INTERVAL)
+            metrics.start_cycle()
+            with metrics.stage('sites'):
+                site_names = await get_site_names()
+            alert_rules.retain(site_names)
+            retain_fingerprints(site_names)
+            with metrics.stage('history'):
+                await history.sync(results_backend, site_names)
+            scheduler.sync(site_names)
+
+            due_sites = scheduler.pop_due(window=POLL_WINDOW)
+            if due_sites:
+                summary_changed = message_for_tg.retain(site_names)
+                if await check_sites(due_sites, history, results_backend, scheduler, message_for_tg, alert):
+                    summary_changed = True
+                await publish(summary_changed)
+                sites_checked.inc(len(due_sites))
+                metrics.finish_cycle(sites=len(due_sites), telegram_queue=telegram_bot.message_queue.qsize())
+
+            next_delay = scheduler.next_delay()
+            if next_delay is None or next_delay > SITES_REFRESH_INTERVAL:
+                next_delay = SITES_REFRESH_INTERVAL
+            await asyncio.sleep(next_delay)
 
         except Exception as e:
             logger.error(f"An error occurred during scheduled check: {e}")
-            await asyncio.sleep(CHECK_INTERVAL)
+            await asyncio.sleep(SITES_REFRESH_INTERVAL)
+
+
+async def scheduled_check():
+    sqlite_store = SQLiteStore(logger=logger)
+    await sqlite_store.init_db()
+    db_connection = DBConnection(logger=logger,
+                                 use_json=False)
+    if RESULTS_BACKEND == 'postgres':
+        results_backend = await create_results_backend(db_connection)
+    else:
+        results_backend = sqlite_store
+    start_compaction(results_backend)
+    await start_telegram(sqlite_store)
+    message_parts = await load_message_ids()
+    message_for_tg = EventMessage()
+
+    async def publish(summary_changed: bool) -> None:
+        nonlocal message_parts
+        # Время в конце сводки обновляется после каждой пачки, даже если данные не изменились:
+        # правится только последняя часть и не чаще раза в минуту
+        message_for_tg.refresh_check_time()
+        message_parts = await update_summary(message_for_tg, message_parts)
+        await save_message_ids(message_parts)
+
+    await run_checks(db_connection.get_sites, results_backend, message_for_tg, publish)
+
+
+async def run_worker(worker_id: str, ring: HashRing):
+    """Проверяет только сайты своего шарда и передает результаты агрегатору."""
+    db_connection = DBConnection(logger=logger,
+                                 use_json=False)
+    results_backend = await create_results_backend(db_connection, worker_id)
+    client = AggregatorClient(worker_id, host=AGGREGATOR_HOST, port=AGGREGATOR_PORT, logger=logger)
+    client.start()
+    # Строки сводки рендерятся в воркере, агрегатор только собирает их
+    message_for_tg = EventMessage()
+
+    async def get_shard_sites() -> List[str]:
+        return [site_name for site_name in await db_connection.get_sites()
+                if ring.node_for(site_name) == worker_id]
+
+    async def publish(summary_changed: bool) -> None:
+        client.publish_lines(message_for_tg.messages)
+
+    try:
+        await run_checks(get_shard_sites, results_backend, message_for_tg, publish, alert=client.send_alert)
+    finally:
+        await client.close()
+        await close_client()
+
+
+async def run_aggregator(ring: HashRing):
+    """Собирает строки сводки от воркеров и владеет выводом в Telegram."""
+    sqlite_store = SQLiteStore(logger=logger)
+    await sqlite_store.init_db()
+    db_connection = DBConnection(logger=logger,
+                                 use_json=False)
+    results_backend = sqlite_store
+    if RESULTS_BACKEND == 'postgres':
+        results_backend = await create_results_backend(db_connection)
+    start_compaction(results_backend)
+    await start_telegram(sqlite_store)
+    message_parts = await load_message_ids()
+    message_for_tg = EventMessage()
+    summary_changed = False
+    cycle_done = asyncio.Event()
+
+    def on_lines(lines, removed) -> None:
+        nonlocal summary_changed
+        if message_for_tg.merge_lines(lines, removed):
+            summary_changed = True
+
+    server = AggregatorServer(on_lines, send_alert, lambda worker_id: cycle_done.set(),
+                              host=AGGREGATOR_HOST, port=AGGREGATOR_PORT, logger=logger)
+    await server.start()
+    logger.info(f"Aggregator is listening on {AGGREGATOR_HOST}:{AGGREGATOR_PORT} for workers {ring.nodes}")
+
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(cycle_done.wait(), timeout=SITES_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            # Воркеры заканчивают пачки почти одновременно; ждем остальных, чтобы править сводку реже
+            await asyncio.sleep(SUMMARY_DEBOUNCE)
+            checked = cycle_done.is_set()
+            cycle_done.clear()
+            try:
+                if message_for_tg.retain(await db_connection.get_sites()):
+                    summary_changed = True
+                # Пока воркеры ничего не прислали, старая сводка в канале не трогается
+                if message_for_tg.messages and (summary_changed or checked or not message_parts):
+                    summary_changed = False
+                    message_for_tg.refresh_check_time()
+                    message_parts = await update_summary(message_for_tg, message_parts)
+                    await save_message_ids(message_parts)
+            except Exception as e:
+                logger.error(f"An error occurred during summary update: {e}")
+    finally:
+        await server.close()
+
+
+async def start_metrics(port: int) -> None:
+    if not port:
+        return
+    try:
+        await metrics.serve(METRICS_HOST, port)
+    except OSError as e:
+        logger.error(f"Cannot start metrics endpoint on {METRICS_HOST}:{port}: {e}")
+
+
+def start_recording(suffix: str = '') -> None:
+    if RECORD_PATH:
+        # Воркеры пишут каждый в свой файл: base.jsonl.gz -> base.worker-0.jsonl.gz
+        path = RECORD_PATH
+        if suffix:
+            directory, file_name = os.path.split(RECORD_PATH)
+            base, _, extension = file_name.partition('.')
+            file_name = f"{base}.{suffix}.{extension}" if extension else f"{base}.{suffix}"
+            path = os.path.join(directory, file_name)
+        set_recorder(ResponseRecorder(path))
+
+
+def worker_process(worker_id: str, nodes: List[str], metrics_port: int) -> None:
+    # Воркеры на одной машине с агрегатором пишут каждый в свой файл лога
+    set_log_file(worker_id)
+
+    async def run() -> None:
+        start_recording(worker_id)
+        await start_metrics(metrics_port)
+        await run_worker(worker_id, HashRing(nodes))
+
+    asyncio.run(run())
 
 
 async def main():
-    await scheduled_check()
+    nodes = [node for node in SHARD_WORKERS.split(',') if node]
+    if not nodes and SHARD_LOCAL_WORKERS:
+        nodes = [f"worker-{index}" for index in range(SHARD_LOCAL_WORKERS)]
+    # С пустым кольцом воркер не нашел бы владельца ни для одного сайта
+    if SHARD_MODE in ('worker', 'aggregator') and not nodes:
+        raise SystemExit(f"SHARD_MODE={SHARD_MODE} requires SHARD_WORKERS or SHARD_LOCAL_WORKERS")
+    if SHARD_MODE == 'worker' and WORKER_ID not in nodes:
+        raise SystemExit(f"WORKER_ID '{WORKER_ID}' is not listed in SHARD_WORKERS ({', '.join(nodes)})")
+    ring = HashRing(nodes)
+    if SHARD_MODE == 'worker':
+        set_log_file(WORKER_ID)
+    await start_metrics(METRICS_PORT)
+
+    if SHARD_MODE == 'worker':
+        start_recording(WORKER_ID)
+        await run_worker(WORKER_ID, ring)
+        return
+
+    processes = []
+    if SHARD_MODE == 'aggregator' and SHARD_LOCAL_WORKERS:
+        # spawn, а не fork: дочерний процесс не должен наследовать запущенный цикл событий
+        context = multiprocessing.get_context('spawn')
+        for index, worker_id in enumerate(nodes):
+            # Каждый локальный воркер отдает метрики на своем порту после порта агрегатора
+            metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+            process = context.Process(target=worker_process, args=(worker_id, nodes, metrics_port),
+                                      name=worker_id, daemon=True)
+            process.start()
+            processes.append(process)
+    try:
+        if SHARD_MODE == 'aggregator':
+            await run_aggregator(ring)
+        else:
+            start_recording()
+            await scheduled_check()
+    finally:
+        for process in processes:
+            process.terminate()
+        await close_client()
+        await telegram_bot.close()
 
 
 if __name__ == "__main__":
@@ -1,2 +1,5 @@
-from .requests import check_events
-
+from .requests import (check_events, iter_events, close_client, limiter, FetchError, set_recorder,
+                       commit_fingerprints, retain_fingerprints)
+from .limiter import AdaptiveLimiter
+from .scheduler import PollScheduler
+from .recorder import ResponseRecorder
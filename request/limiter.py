@@ -0,0 +1,130 @@
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Deque, Optional
+
+from logger import logger
+
+
+class AdaptiveLimiter:
+    """
+    Ограничитель параллельных запросов по схеме AIMD.
+
+    Пока ответы приходят без ошибок и p95 задержки не растет, лимит
+    увеличивается примерно на единицу за каждые `limit` успешных запросов.
+    На 429/5xx, сетевых ошибках или росте p95 относительно базового уровня
+    лимит умножается на backoff_ratio.
+    """
+
+    def __init__(self,
+                 initial_limit=3,
+                 min_limit=1,
+                 max_limit=20,
+                 backoff_ratio=0.5,
+                 latency_tolerance=2.0,
+                 window=200,
+                 min_samples=20):
+        """
+        :param initial_limit: Начальное количество параллельных запросов
+        :param min_limit: Нижняя граница лимита
+        :param max_limit: Верхняя граница лимита
+        :param backoff_ratio: Во сколько раз уменьшать лимит при перегрузке
+        :param latency_tolerance: Во сколько раз p95 может превысить базовый уровень
+        :param window: Количество последних задержек для расчета перцентилей
+        :param min_samples: Минимум задержек, после которого учитывается p95
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.min_samples = min_samples
+        self.in_flight = 0
+        self.requests_count = 0
+        self.errors_count = 0
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def p50_latency(self) -> float:
+        return self._percentile(0.5)
+
+    @property
+    def p95_latency(self) -> float:
+        return self._percentile(0.95)
+
+    def snapshot(self) -> dict:
+        return {'limit': self.limit,
+                'in_flight': self.in_flight,
+                'p50_latency': self.p50_latency,
+                'p95_latency': self.p95_latency,
+                'requests': self.requests_count,
+                'errors': self.errors_count}
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncGenerator[None, None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, latency: float, status_code: Optional[int] = None, failed=False) -> None:
+        """
+        Учитывает результат одного запроса.
+
+        :param latency: Время выполнения запроса в секундах
+        :param status_code: HTTP-статус ответа; None, если ответа не было
+        :param failed: Запрос завершился ошибкой
+        """
+        self.requests_count += 1
+        if failed:
+            self.errors_count += 1
+        overloaded = (status_code == 429 or
+                      (status_code is not None and status_code >= 500) or
+                      (failed and status_code is None))
+        if status_code is not None:
+            self._latencies.append(latency)
+
+        p95_latency = self.p95_latency
+        if len(self._latencies) >= self.min_samples:
+            if self._baseline_latency is None:
+                self._baseline_latency = p95_latency
+            elif p95_latency > self._baseline_latency * self.latency_tolerance:
+                overloaded = True
+            # Базовый уровень медленно следует за p95, чтобы не застрять на минимуме лимита
+            self._baseline_latency = 0.99 * self._baseline_latency + 0.01 * p95_latency
+
+        if overloaded:
+            self._decrease(p95_latency)
+        elif not failed:
+            self._limit = min(self._limit + 1 / self._limit, float(self.max_limit))
+
+    def _decrease(self, p95_latency: float) -> None:
+        # Запросы, начатые до предыдущего снижения, не должны снижать лимит повторно
+        now = time.monotonic()
+        if now - self._last_decrease < max(p95_latency, 1.0):
+            return
+        self._last_decrease = now
+        previous_limit = self.limit
+        self._limit = max(self._limit * self.backoff_ratio, float(self.min_limit))
+        if self.limit != previous_limit:
+            logger.info(f"Concurrency limit decreased from {previous_limit} to {self.limit} "
+                        f"(p95 latency {p95_latency:.2f}s)")
+
+    def _percentile(self, fraction: float) -> float:
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
@@ -0,0 +1,43 @@
+import gzip
+import json
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+
+
+class ResponseRecorder:
+    """
+    Запись ответов check_ticket_availability для офлайн-бэктеста.
+
+    Каждая пачка проверок дописывается в файл одной строкой JSON:
+    {"time": ..., "responses": {site_name: payload}}. Если ответ сайта не
+    изменился с прошлой проверки (304 или то же тело), вместо payload пишется
+    null - при воспроизведении берется предыдущий payload этого сайта.
+    Файл с расширением .gz пишется сжатым.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._responses: Dict[str, Optional[dict]] = {}
+
+    def record(self, site_name: str, payload: Optional[dict]) -> None:
+        """:param payload: Разобранный ответ или None, если он не изменился"""
+        self._responses[site_name] = payload
+
+    async def end_cycle(self) -> None:
+        if not self._responses:
+            return
+        responses, self._responses = self._responses, {}
+        line = {'time': datetime.now().isoformat(timespec='seconds'), 'responses': responses}
+        # Сериализация и запись большой пачки не должны занимать цикл событий
+        await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: dict) -> None:
+        data = json.dumps(line, ensure_ascii=False, separators=(',', ':')) + '\n'
+        if self.path.endswith('.gz'):
+            # Каждая запись - отдельный gzip-член, gzip.open читает их подряд
+            with gzip.open(self.path, 'at', encoding='utf-8') as file:
+                file.write(data)
+        else:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(data)
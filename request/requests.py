@@ -1,16 +1,40 @@
+import os
+import time
 import httpx
 import asyncio
+import hashlib
+from collections import deque, namedtuple
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+from dotenv import load_dotenv
 
-from logger import logger
+from logger import logger, metrics
+from calculate import CycleResults
+from .limiter import AdaptiveLimiter
+from .retry import RetryScheduler
+from .recorder import ResponseRecorder
+
+load_dotenv()
 
 MAX_CONCURRENT_REQUESTS = 3
 RETRY_LIMIT = 3
+# Бюджет времени на повторы в пределах одного цикла
+CYCLE_DEADLINE = float(os.getenv('CYCLE_DEADLINE', 600))
+# Сколько запросов (включая ожидающие слот лимитера) может быть создано одновременно
+MAX_PENDING_REQUESTS = int(os.getenv('MAX_PENDING_REQUESTS', 200))
+# Пул соединений живет между циклами, поэтому keepalive длиннее CHECK_INTERVAL
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 900))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+# HTTP/2 требует пакет h2 (httpx[http2]) и используется только для https
+HTTP2 = os.getenv('HTTP2', 'false').lower() in ('1', 'true', 'yes')
+# Верхняя граница адаптивного лимита; MAX_CONCURRENT_REQUESTS - стартовое значение
+MAX_CONCURRENT_REQUESTS_LIMIT = int(os.getenv('MAX_CONCURRENT_REQUESTS_LIMIT', HTTP_MAX_CONNECTIONS))
 headers = httpx.Headers(headers={
         "Accept": "application/json",
         "Accept-Encoding": "gzip, deflate, br, zstd",
         "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
         "Cache-Control": "max-age=0",
-        "Connection": "keep-alive",
         "DNT": "1",
         "Sec-Fetch-Dest": "document",
         "Sec-Fetch-Mode": "navigate",
@@ -23,48 +47,222 @@ headers = httpx.Headers(headers={
         "sec-ch-ua-platform": "\"Linux\""
     }, encoding='utf-8')
 
+_client: Optional[httpx.AsyncClient] = None
+# Отпечаток последнего ответа по каждому сайту: ETag, хэш тела и разобранный результат
+Fingerprint = namedtuple('Fingerprint', ['etag', 'digest', 'result'])
+_fingerprints: Dict[str, Fingerprint] = {}
+# Отпечатки полученных, но еще не обработанных ответов; переносятся в _fingerprints
+# commit_fingerprints, чтобы ответ, обработка которого упала, снова считался изменившимся
+_pending_fingerprints: Dict[str, Fingerprint] = {}
+# Запись ответов для бэктеста, включается set_recorder
+_recorder: Optional[ResponseRecorder] = None
+# Живет между циклами, чтобы не обучаться заново каждые CHECK_INTERVAL секунд
+limiter = AdaptiveLimiter(initial_limit=MAX_CONCURRENT_REQUESTS,
+                          max_limit=MAX_CONCURRENT_REQUESTS_LIMIT)
+requests_total = metrics.counter('http_requests_total', 'Requests to the ticket API by status')
+retries_total = metrics.counter('http_retries_total', 'Retried site checks')
+fetch_errors_total = metrics.counter('fetch_errors_total', 'Site checks failed after all retries')
+metrics.gauge('concurrency_limit', 'Current adaptive concurrency limit', lambda: limiter.limit)
+metrics.gauge('requests_in_flight', 'Requests currently in flight', lambda: limiter.in_flight)
+metrics.gauge('http_latency_p95_seconds', 'p95 latency over the limiter window', lambda: limiter.p95_latency)
+
+
+def set_recorder(recorder: Optional[ResponseRecorder]) -> None:
+    global _recorder
+    _recorder = recorder
+
+
+def get_client() -> httpx.AsyncClient:
+    """Возвращает HTTP-клиент, общий для всех циклов проверки."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers=headers,
+            http2=_http2_enabled(),
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _http2_enabled() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP2 is enabled but the h2 package is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+class FetchError(Exception):
+    def __init__(self, site_name: str, attempts: int, error: Exception):
+        super().__init__(site_name, attempts, error)
+        self.site_name = site_name
+        self.attempts = attempts
+        self.error = error
+
+    def __str__(self):
+        return f"{self.site_name}: failed after {self.attempts} attempt(s): {self.error}"
+
+
+async def iter_events(base_url: str, site_names: Iterable[str]) -> AsyncIterator[Tuple[Optional[tuple], Optional[Exception]]]:
+    """
+    Выдает (result, error) по каждому сайту сразу после завершения его запроса.
+
+    Одновременно создается не больше MAX_PENDING_REQUESTS задач, поэтому
+    память не зависит от размера списка сайтов, а новые запросы не
+    запускаются, пока потребитель не забрал готовые результаты.
+    """
+    client = get_client()
+    retries = RetryScheduler(deadline=time.monotonic() + CYCLE_DEADLINE,
+                             retry_limit=RETRY_LIMIT)
+    site_names = iter(site_names)
+    completed = deque()
+    pending = set()
+
+    async def sem_task(site_name, attempt):
+        async with limiter.acquire():
+            try:
+                completed.append((await _handle_event_data(client, base_url, site_name), None))
+                return
+            except Exception as e:
+                error = e
+        # Слот лимитера уже освобожден, повтор ждет в RetryScheduler
+        logger.warning(f"Attempt {attempt + 1} for {site_name} failed: {error}")
+        if retries.schedule(site_name, attempt + 1):
+            retries_total.inc()
+        else:
+            fetch_errors_total.inc()
+            completed.append((None, FetchError(site_name, attempt + 1, error)))
+
+    def spawn(site_name, attempt=0):
+        pending.add(asyncio.create_task(sem_task(site_name, attempt)))
+
+    try:
+        exhausted = False
+        while True:
+            for site_name, attempt in retries.pop_due():
+                spawn(site_name, attempt)
+            while not exhausted and len(pending) < MAX_PENDING_REQUESTS:
+                site_name = next(site_names, None)
+                if site_name is None:
+                    exhausted = True
+                else:
+                    spawn(site_name)
+
+            while completed:
+                yield completed.popleft()
+
+            if pending:
+                done, _ = await asyncio.wait(pending,
+                                             timeout=retries.next_delay(),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                pending.difference_update(done)
+            elif retries:
+                await asyncio.sleep(retries.next_delay())
+            elif exhausted:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+
+    while completed:
+        yield completed.popleft()
+    if _recorder is not None:
+        await _recorder.end_cycle()
+
+
 async def check_events(base_url: str, site_names: list):
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    async with httpx.AsyncClient() as client:
-        async def sem_task(site_name):
-            async with semaphore:
-                try:
-                    return await _handle_event_data(client, base_url, site_name), None
-                except Exception as e:
-                    return None, e
-
-        tasks = [sem_task(site_name) for site_name in site_names]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-    successful_results = (result for result, error in results if error is None)
-    errors = (error for result, error in results if error is not None)
+    """:return: (CycleResults с успешными проверками, список FetchError)"""
+    successful_results = CycleResults()
+    errors = []
+    async for result, error in iter_events(base_url, site_names):
+        if error is None:
+            successful_results.append(*result)
+        else:
+            errors.append(error)
+    # Результаты отдаются вызывающему целиком, дальше их обработка - его забота
+    commit_fingerprints(successful_results.site_names)
     return successful_results, errors
 
+
+def commit_fingerprints(site_names: Iterable[str]) -> None:
+    """Запоминает отпечатки ответов, результаты которых обработаны и сохранены."""
+    for site_name in site_names:
+        fingerprint = _pending_fingerprints.pop(site_name, None)
+        if fingerprint is not None:
+            _fingerprints[site_name] = fingerprint
+
+
+def retain_fingerprints(site_names: Iterable[str]) -> None:
+    """Забывает отпечатки сайтов, которых больше нет в списке."""
+    site_names = set(site_names)
+    for fingerprints in (_fingerprints, _pending_fingerprints):
+        for site_name in fingerprints.keys() - site_names:
+            del fingerprints[site_name]
+
 async def _handle_event_data(client, base_url, site_name):
+    """
+    :return: (site_name, total_events_count, events_with_tickets_count,
+              events_without_tickets_count, changed)
+    """
     params = {'site-name': site_name}
-    data = await _fetch_event_data(client, base_url, params)
-    if data and "total_events_count" in data:
-        total_events_count = data["total_events_count"]
-        events_with_tickets_count = data["events_with_tickets_count"]
-        events_without_tickets_count = data["events_without_tickets_count"]
-        return (site_name,
-                total_events_count,
-                events_with_tickets_count,
-                events_without_tickets_count)
-    return None
-
-async def _fetch_event_data(client, url, params):
-    retries = 0
-    while retries < RETRY_LIMIT:
-        try:
-            response = await client.get(url, params=params, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            return data
-        except Exception as exc:
-            logger.error(f"An error occurred while requesting {url} with params {params}: {exc}")
-            retries += 1
-            await asyncio.sleep(2 ** retries)
+    fingerprint = _fingerprints.get(site_name)
+    request_headers = None
+    if fingerprint and fingerprint.etag:
+        request_headers = {'If-None-Match': fingerprint.etag}
 
-    return None
+    response = await _fetch_event_data(client, base_url, params, request_headers)
+    if response.status_code == 304 and fingerprint:
+        if _recorder is not None:
+            _recorder.record(site_name, None)
+        return fingerprint.result + (False,)
 
+    etag = response.headers.get('ETag')
+    digest = hashlib.blake2b(response.content, digest_size=16).digest()
+    if fingerprint and fingerprint.digest == digest:
+        _pending_fingerprints[site_name] = fingerprint._replace(etag=etag)
+        if _recorder is not None:
+            _recorder.record(site_name, None)
+        return fingerprint.result + (False,)
+
+    data = response.json()
+    if not data or "total_events_count" not in data:
+        raise ValueError(f"Unexpected response for {site_name}: {data}")
+    result = (site_name,
+              data["total_events_count"],
+              data["events_with_tickets_count"],
+              data["events_without_tickets_count"])
+    # Тело могло измениться без изменения счетчиков (например, служебные поля)
+    changed = fingerprint is None or fingerprint.result != result
+    if _recorder is not None:
+        _recorder.record(site_name, data)
+    _pending_fingerprints[site_name] = Fingerprint(etag=etag, digest=digest, result=result)
+    return result + (changed,)
+
+async def _fetch_event_data(client, url, params, request_headers=None):
+    started = time.monotonic()
+    status_code = None
+    try:
+        response = await client.get(url, params=params, headers=request_headers)
+        status_code = response.status_code
+        if status_code != 304:
+            response.raise_for_status()
+    except Exception:
+        limiter.record(time.monotonic() - started, status_code, failed=True)
+        requests_total.inc(status=str(status_code) if status_code else 'error')
+        raise
+    limiter.record(time.monotonic() - started, status_code)
+    requests_total.inc(status=str(status_code))
+    return response
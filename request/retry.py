@@ -0,0 +1,64 @@
+import time
+import heapq
+import random
+from itertools import count
+from typing import Any, List, Optional, Tuple
+
+
+class RetryScheduler:
+    """
+    Очередь отложенных повторов запросов.
+
+    Повтор ожидает в куче, а не в корутине, которая держит слот лимитера,
+    поэтому сбойный сайт не занимает параллельность на время ожидания.
+    Повторы, которые не успевают до дедлайна цикла, не планируются.
+    """
+
+    def __init__(self, deadline: float, retry_limit=3, base_delay=2.0, max_delay=30.0):
+        """
+        :param deadline: Момент time.monotonic(), после которого повторы не выполняются
+        :param retry_limit: Максимальное количество попыток на сайт
+        :param base_delay: Базовая задержка, удваивается с каждой попыткой
+        :param max_delay: Максимальная задержка перед повтором
+        """
+        self.deadline = deadline
+        self.retry_limit = retry_limit
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap: List[Tuple[float, int, Any, int]] = []
+        self._counter = count()
+
+    def schedule(self, item: Any, attempt: int) -> bool:
+        """
+        Планирует повтор с экспоненциальной задержкой и случайным разбросом.
+
+        :param item: Что повторить (имя сайта)
+        :param attempt: Номер следующей попытки, начиная с 1
+        :return: False, если попытки закончились или повтор не успевает до дедлайна
+        """
+        if attempt >= self.retry_limit:
+            return False
+        delay = min(self.base_delay * 2 ** attempt, self.max_delay)
+        due = time.monotonic() + random.uniform(delay / 2, delay)
+        if due >= self.deadline:
+            return False
+        heapq.heappush(self._heap, (due, next(self._counter), item, attempt))
+        return True
+
+    def pop_due(self) -> List[Tuple[Any, int]]:
+        """:return: Повторы, время которых наступило, в виде (item, attempt)"""
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, item, attempt = heapq.heappop(self._heap)
+            due.append((item, attempt))
+        return due
+
+    def next_delay(self) -> Optional[float]:
+        """:return: Секунды до ближайшего повтора или None, если очередь пуста"""
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - time.monotonic(), 0.0)
+
+    def __len__(self) -> int:
+        return len(self._heap)
@@ -0,0 +1,123 @@
+import time
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class PollScheduler:
+    """
+    Очередь с приоритетом по времени следующей проверки каждого сайта.
+
+    Интервал подбирается по каждому сайту отдельно: сайты с меняющейся
+    доступностью или близкие к порогам предупреждений проверяются чаще,
+    стабильные и распроданные - все реже, вплоть до max_interval.
+    Следующая проверка отсчитывается от запланированного, а не от
+    фактического времени, поэтому расписание не сдвигается.
+    """
+
+    def __init__(self,
+                 base_interval=800,
+                 min_interval=200,
+                 max_interval=7200,
+                 backoff=1.5,
+                 volatility_threshold=5.0):
+        """
+        :param base_interval: Интервал для сайтов, у которых данные изменились
+        :param min_interval: Интервал для нестабильных сайтов и сайтов у порогов
+        :param max_interval: Максимальный интервал для стабильных сайтов
+        :param backoff: Множитель интервала для сайтов без изменений
+        :param volatility_threshold: Стандартное отклонение процента, выше которого сайт нестабилен
+        """
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.volatility_threshold = volatility_threshold
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._polled_at: Dict[str, float] = {}
+        self._intervals: Dict[str, float] = {}
+
+    def sync(self, site_names: Iterable[str]) -> None:
+        """Добавляет новые сайты (к проверке сразу) и забывает удаленные."""
+        site_names = set(site_names)
+        for site_name in self._due.keys() - site_names:
+            del self._due[site_name]
+            self._polled_at.pop(site_name, None)
+            self._intervals.pop(site_name, None)
+        now = time.monotonic()
+        for site_name in site_names - self._due.keys():
+            self._intervals[site_name] = self.base_interval
+            self._push(site_name, now)
+
+    def pop_due(self, window: float = 0.0) -> List[str]:
+        """
+        :param window: Забрать также сайты, срок которых наступит в ближайшие window секунд
+        :return: Сайты, которые пора проверить
+        """
+        horizon = time.monotonic() + window
+        due = []
+        while self._heap and self._heap[0][0] <= horizon:
+            due_time, site_name = heapq.heappop(self._heap)
+            if self._due.get(site_name) != due_time:
+                continue
+            due.append(site_name)
+            self._polled_at[site_name] = due_time
+        for site_name in due:
+            # Запасной слот на случай, если результат проверки так и не придет
+            self._push(site_name, self._polled_at[site_name] + self._intervals[site_name])
+        return due
+
+    def next_delay(self) -> Optional[float]:
+        """:return: Секунды до ближайшей проверки или None, если сайтов нет"""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - time.monotonic(), 0.0)
+
+    def update_interval(self,
+                        site_name: str,
+                        changed: bool,
+                        volatility: float = 0.0,
+                        near_threshold: bool = False) -> float:
+        """
+        Пересчитывает интервал сайта по результату проверки.
+
+        :param changed: Данные изменились по сравнению с предыдущей проверкой
+        :param volatility: Стандартное отклонение процента за окно истории
+        :param near_threshold: Сайт близок к порогам предупреждений
+        :return: Новый интервал в секундах
+        """
+        interval = self._intervals.get(site_name, self.base_interval)
+        if near_threshold or volatility > self.volatility_threshold:
+            interval = self.min_interval
+        elif changed:
+            interval = self.base_interval
+        else:
+            interval = min(max(interval, self.base_interval) * self.backoff, self.max_interval)
+        if site_name in self._intervals:
+            self._intervals[site_name] = interval
+        return interval
+
+    def reschedule(self, site_name: str) -> None:
+        """Планирует следующую проверку сайта через его текущий интервал."""
+        previous_due = self._polled_at.pop(site_name, None)
+        if previous_due is None:
+            return
+        interval = self._intervals[site_name]
+        now = time.monotonic()
+        next_due = previous_due + interval
+        if next_due <= now:
+            # Пропущенные слоты не догоняются, сетка расписания сохраняется
+            next_due += interval * ((now - next_due) // interval + 1)
+        self._push(site_name, next_due)
+
+    def _push(self, site_name: str, due_time: float) -> None:
+        self._due[site_name] = due_time
+        heapq.heappush(self._heap, (due_time, site_name))
+
+    def interval(self, site_name: str) -> Optional[float]:
+        return self._intervals.get(site_name)
+
+    def __len__(self) -> int:
+        return len(self._due)
@@ -0,0 +1,209 @@
+import json
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+# Воркер, потерявший связь с агрегатором, хранит не больше стольких сообщений
+MAX_BUFFERED_MESSAGES = 10000
+RECONNECT_DELAY = 5
+# Строки сводки отправляются порциями, чтобы сообщение не упиралось в лимит строки StreamReader
+MAX_LINES_PER_MESSAGE = 200
+# Лимит длины одного сообщения на стороне агрегатора (по умолчанию в asyncio 64 КиБ)
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class AggregatorServer:
+    """
+    Прием результатов от воркеров.
+
+    Протокол: JSON по строке на сообщение поверх TCP. Воркер присылает
+    изменившиеся строки сводки ('lines'), все свои строки после
+    переподключения ('snapshot', несколькими сообщениями, последнее с
+    last=True), готовые предупреждения ('alert') и отметку о конце порции
+    проверок ('cycle').
+    """
+
+    def __init__(self,
+                 on_lines: Callable[[Dict[str, str], list], None],
+                 on_alert: Callable[[str], Awaitable[None]],
+                 on_cycle: Callable[[str], None],
+                 host='127.0.0.1',
+                 port=8765,
+                 logger=None):
+        """
+        :param on_lines: Принимает новые строки сводки и список удаленных сайтов
+        :param on_alert: Отправляет предупреждение в Telegram
+        :param on_cycle: Вызывается, когда воркер закончил порцию проверок
+        """
+        self.on_lines = on_lines
+        self.on_alert = on_alert
+        self.on_cycle = on_cycle
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Воркер, последним приславший строку сайта; удалять ее может только он
+        self._owners: Dict[str, str] = {}
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_worker, self.host, self.port,
+                                                  limit=STREAM_LIMIT)
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        worker_id = None
+        # Сайты из уже полученных частей снимка
+        snapshot_sites = set()
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message['type'] == 'hello':
+                    worker_id = message['worker']
+                    if self.logger:
+                        self.logger.info(f"Worker {worker_id} connected")
+                elif message['type'] == 'snapshot':
+                    snapshot_sites.update(message['lines'])
+                    removed = []
+                    if message.get('last', True):
+                        # Строки воркера, которых нет в снимке, были удалены, пока не было связи
+                        removed = [site_name for site_name, owner in self._owners.items()
+                                   if owner == worker_id and site_name not in snapshot_sites]
+                        snapshot_sites = set()
+                    self._apply_lines(worker_id, message['lines'], removed)
+                elif message['type'] == 'lines':
+                    self._apply_lines(worker_id, message['lines'], message['removed'])
+                elif message['type'] == 'alert':
+                    await self.on_alert(message['message'])
+                elif message['type'] == 'cycle':
+                    self.on_cycle(worker_id)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Error reading from worker {worker_id}: {e}")
+        finally:
+            writer.close()
+            if self.logger:
+                self.logger.info(f"Worker {worker_id} disconnected")
+
+    def _apply_lines(self, worker_id: str, lines: Dict[str, str], removed: list) -> None:
+        for site_name in lines:
+            self._owners[site_name] = worker_id
+        removed = [site_name for site_name in removed
+                   if self._owners.get(site_name) == worker_id]
+        for site_name in removed:
+            del self._owners[site_name]
+        self.on_lines(lines, removed)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class AggregatorClient:
+    """
+    Отправка результатов воркера агрегатору.
+
+    Сообщения буферизуются и отправляются фоновой задачей, поэтому цикл
+    проверок не ждет сети. При обрыве связи воркер переподключается, а
+    буфер отправляется заново, а вместо накопленных изменений строк
+    агрегатор получает все строки сводки целиком. Предупреждения хранятся
+    в отдельной очереди без ограничения длины и уходят первыми.
+    """
+
+    def __init__(self, worker_id: str, host='127.0.0.1', port=8765, logger=None):
+        self.worker_id = worker_id
+        self.host = host
+        self.port = port
+        self.logger = logger
+        self._buffer: Deque[dict] = deque(maxlen=MAX_BUFFERED_MESSAGES)
+        self._alerts: Deque[dict] = deque()
+        self._dropped = 0
+        self._ready = asyncio.Event()
+        self._sent_lines: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def publish_lines(self, lines: Dict[str, str]) -> None:
+        """Передает строки сводки, изменившиеся с прошлой отправки, и удаленные сайты."""
+        changed = {site_name: line for site_name, line in lines.items()
+                   if self._sent_lines.get(site_name) != line}
+        removed = [site_name for site_name in self._sent_lines if site_name not in lines]
+        if changed or removed:
+            self._sent_lines = dict(lines)
+            changed = list(changed.items())
+            for start in range(0, max(len(changed), len(removed)), MAX_LINES_PER_MESSAGE):
+                end = start + MAX_LINES_PER_MESSAGE
+                self._put({'type': 'lines', 'lines': dict(changed[start:end]), 'removed': removed[start:end]})
+        self._put({'type': 'cycle'})
+
+    async def send_alert(self, message: str) -> None:
+        self._alerts.append({'type': 'alert', 'message': message})
+        self._ready.set()
+
+    def _put(self, message: dict) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+            if self._dropped == 1 and self.logger:
+                self.logger.warning(f"Aggregator buffer is full ({self._buffer.maxlen} messages), "
+                                    f"dropping the oldest ones")
+        self._buffer.append(message)
+        self._ready.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                if self.logger:
+                    self.logger.error(f"Cannot connect to aggregator at {self.host}:{self.port}: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                writer.write(self._encode({'type': 'hello', 'worker': self.worker_id}))
+                if self._dropped:
+                    if self.logger:
+                        self.logger.warning(f"Dropped {self._dropped} messages while aggregator was unreachable")
+                    self._dropped = 0
+                # Неотправленные изменения строк и недоотправленный прошлый снимок
+                # заменяются полным снимком
+                pending = [message for message in self._buffer
+                           if message['type'] not in ('lines', 'snapshot')]
+                self._buffer.clear()
+                snapshot = list(self._sent_lines.items())
+                # Хотя бы одна часть с last=True уходит всегда, даже если строк нет
+                for start in range(0, max(len(snapshot), 1), MAX_LINES_PER_MESSAGE):
+                    end = start + MAX_LINES_PER_MESSAGE
+                    self._buffer.append({'type': 'snapshot',
+                                         'lines': dict(snapshot[start:end]),
+                                         'last': end >= len(snapshot)})
+                self._buffer.extend(pending)
+                await writer.drain()
+                while True:
+                    while not self._alerts and not self._buffer:
+                        self._ready.clear()
+                        await self._ready.wait()
+                    queue = self._alerts or self._buffer
+                    message = queue[0]
+                    writer.write(self._encode(message))
+                    await writer.drain()
+                    # Пока шла отправка, переполненный буфер мог сам вытеснить сообщение
+                    if queue and queue[0] is message:
+                        queue.popleft()
+            except (OSError, ConnectionError) as e:
+                if self.logger:
+                    self.logger.error(f"Lost connection to aggregator: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                writer.close()
+
+    @staticmethod
+    def _encode(message: dict) -> bytes:
+        return json.dumps(message, ensure_ascii=False).encode() + b'\n'
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
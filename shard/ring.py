@@ -0,0 +1,64 @@
+from bisect import bisect_right
+from hashlib import blake2b
+from typing import Dict, Iterable, List, Tuple
+
+
+class HashRing:
+    """
+    Консистентное хэширование сайтов по воркерам.
+
+    Каждый воркер занимает replicas точек на кольце; сайт достается
+    воркеру с ближайшей точкой по часовой стрелке. При добавлении или
+    удалении воркера переезжает только около 1/N сайтов.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas=128):
+        """
+        :param nodes: Идентификаторы воркеров
+        :param replicas: Количество виртуальных точек на воркер
+        """
+        self.replicas = replicas
+        self._points: List[Tuple[int, str]] = []
+        self._keys: List[int] = []
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def add(self, node: str) -> None:
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        self._points.extend((self._hash(f"{node}#{replica}"), node) for replica in range(self.replicas))
+        self._points.sort()
+        self._keys = [point for point, _ in self._points]
+
+    def remove(self, node: str) -> None:
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [(point, owner) for point, owner in self._points if owner != node]
+        self._keys = [point for point, _ in self._points]
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("Hash ring has no nodes")
+        index = bisect_right(self._keys, self._hash(key)) % len(self._points)
+        return self._points[index][1]
+
+    def assign(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        """:return: Словарь воркер -> его сайты"""
+        shards: Dict[str, List[str]] = {node: [] for node in self._nodes}
+        for key in keys:
+            shards[self.node_for(key)].append(key)
+        return shards
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
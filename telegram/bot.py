@@ -1,13 +1,16 @@
 import os
 import asyncio
 from aiogram import Bot, Dispatcher
-from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter, TelegramBadRequest
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from dotenv import load_dotenv
 import html
 from telethon import TelegramClient
 from collections import namedtuple
 
-from logger import logger
+from logger import logger, metrics
+from .dispatcher import MessageDispatcher
 
 load_dotenv()
 
@@ -22,120 +25,158 @@ CHANNEL_WARNING = int(os.getenv('TELEGRAM_CHANNEL_WARNING'))
 api_id = int(os.getenv('API_ID'))
 api_hash = os.getenv('API_HASH')
 phone_number = os.getenv('TELEPHONE_NUMBER')
+# Собственный сервер Bot API (например, локальный telegram-bot-api или заглушка для бенчмарков)
+api_server = os.getenv('TELEGRAM_API_SERVER')
 session_file = os.path.join(os.path.dirname(__file__), 'user.session')
+# Telegram принимает не больше 100 id в одном запросе на удаление
+DELETE_BATCH_SIZE = 100
+telegram_tasks_total = metrics.counter('telegram_tasks_total', 'Telegram tasks executed by type')
 
 
 class TelegramBot:
-    def __init__(self, token, CHANNEL_INFO, CHANNEL_WARNING, initial_delay=1):
-        self.bot = Bot(token=token)
+    def __init__(self, token, CHANNEL_INFO, CHANNEL_WARNING, api_server=None):
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_server)) if api_server else None
+        self.bot = Bot(token=token, session=session)
         self.dp = Dispatcher()
         self.CHANNEL_INFO = CHANNEL_INFO
         self.CHANNEL_WARNING = CHANNEL_WARNING
-        self.message_queue: asyncio.Queue[dict] = asyncio.Queue()
-
-        self.delay = initial_delay
+        self.message_queue = MessageDispatcher(self._execute)
+        self.outbox = None
+        self._user_client = None
+        self._user_client_lock = asyncio.Lock()
 
     async def start_polling(self):
-        asyncio.create_task(self.process_queue(self.message_queue))
         await self.dp.start_polling(self.bot)
 
-    async def add_to_queue(self, tg_task):
-        await self.message_queue.put(tg_task)
-
-    async def process_queue(self, queue):
-        while True:
-            tg_task = await queue.get()
-            if tg_task.type == 'send':
-                await self.tg_send_message(tg_task.chat_id,
-                                           tg_task.message)
-            elif tg_task.type == 'edit':
-                await self.tg_edit_message(tg_task.chat_id,
-                                           tg_task.message_id,
-                                           tg_task.message)
-            elif tg_task.type == 'delete':
-                await self.tg_delete_messages(tg_task.chat_id,
-                                              tg_task.limit)
-            await asyncio.sleep(self.delay)
+    async def start_outbox(self, outbox):
+        """
+        Подключает персистентную очередь и переотправляет сообщения,
+        не подтвержденные до перезапуска.
+        """
+        self.outbox = outbox
+        for entry in await outbox.lease(reclaim=True):
+            self._dispatch_outbox_entry(entry)
+        asyncio.create_task(outbox.run(self._dispatch_outbox_entry))
+
+    async def add_to_queue(self, tg_task, durable=False) -> asyncio.Future:
+        """
+        Ставит задачу в очередь чата.
+
+        :param durable: Сохранить отправку в outbox, чтобы она пережила перезапуск
+        :return: Future с результатом задачи (message_id для отправки)
+        """
+        if durable and self.outbox is not None and tg_task.type == 'send':
+            return self._dispatch_outbox_entry(self.outbox.enqueue(tg_task.chat_id, tg_task.message))
+        return self.message_queue.put(tg_task)
+
+    def _dispatch_outbox_entry(self, entry) -> asyncio.Future:
+        future = self.message_queue.put(SendTask(type=entry.type, message=entry.message, chat_id=entry.chat_id))
+
+        def ack_on_success(done: asyncio.Future):
+            if not done.cancelled() and done.result() is not None:
+                self.outbox.ack(entry)
+
+        future.add_done_callback(ack_on_success)
+        return future
+
+    async def _execute(self, tg_task):
+        telegram_tasks_total.inc(type=tg_task.type)
+        if tg_task.type == 'send':
+            return await self._send_message(tg_task.chat_id, tg_task.message)
+        elif tg_task.type == 'edit':
+            return await self._edit_message(tg_task.chat_id, tg_task.message_id, tg_task.message)
+        elif tg_task.type == 'delete':
+            return await self.tg_delete_messages(tg_task.chat_id, tg_task.limit)
 
     async def tg_send_message(self, chat_id, message):
-        try:
-            sent_message = await self.bot.send_message(chat_id=chat_id,
-                                                       text=html.escape(message))
-            self.delay = 1
-            return sent_message.message_id
-        except TelegramRetryAfter as e:
-            logger.warning(f"Rate limit exceeded. Sleeping for {e.retry_after} seconds.")
-            self.delay = e.retry_after + 2
-            await self.add_to_queue(chat_id, {'type': 'send', 'message': message})
-        except TelegramAPIError as e:
-            logger.error(f"Telegram API error occurred: {e}")
-            await self.add_to_queue(chat_id, {'type': 'send', 'message': message})
+        return await self.message_queue.put(SendTask(type='send', message=message, chat_id=chat_id))
 
     async def tg_edit_message(self, chat_id, message_id, message):
+        return await self.message_queue.put(
+            EditMessageTask(type='edit', chat_id=chat_id, message_id=message_id, message=message)
+        )
+
+    async def _send_message(self, chat_id, message):
+        sent_message = await self.bot.send_message(chat_id=chat_id,
+                                                   text=html.escape(message))
+        return sent_message.message_id
+
+    async def _edit_message(self, chat_id, message_id, message):
+        """
+        :return: message_id отредактированного (или заново отправленного) сообщения;
+                 None диспетчер возвращает только при ошибке
+        """
         try:
             await self.bot.edit_message_text(chat_id=chat_id,
                                              message_id=message_id,
                                              text=message)
-            self.delay = 1
-        except TelegramRetryAfter as e:
-            logger.warning(f"Rate limit exceeded. Sleeping for {e.retry_after} seconds.")
-            self.delay = e.retry_after + 2
-            await self.add_to_queue(
-                EditMessageTask(type='edit', chat_id=telegram_bot.CHANNEL_INFO,
-                                message_id=message_id,
-                                message=message)
-            )
+            return message_id
         except TelegramBadRequest as e:
             if 'message is not modified' in str(e):
                 logger.warning(f"Message not modified. Skipping update.")
-                return
+                return message_id
             elif ('message to edit not found' in str(e) or
                   'MESSAGE_ID_INVALID' in str(e)):
                 logger.warning(f"{str(e)} {message}")
-                new_message_id = await self.tg_send_message(chat_id, message)
+                new_message_id = await self._send_message(chat_id, message)
                 return new_message_id
-        except TelegramAPIError as e:
-            logger.error(f"Telegram API error occurred: {e}")
-            await self.add_to_queue(
-                EditMessageTask(type='edit', chat_id=telegram_bot.CHANNEL_INFO,
-                                message_id=message_id,
-                                message=message)
-            )
+            raise
+
+    async def get_user_client(self) -> TelegramClient:
+        """Возвращает клиент Telethon, общий на всё время работы процесса."""
+        async with self._user_client_lock:
+            if self._user_client is None:
+                client = TelegramClient(session_file, api_id, api_hash)
+                await client.start(phone=phone_number)
+                self._user_client = client
+            elif not self._user_client.is_connected():
+                await self._user_client.connect()
+            return self._user_client
+
+    async def close(self):
+        await self.message_queue.close()
+        if self._user_client is not None:
+            await self._user_client.disconnect()
+            self._user_client = None
+        await self.bot.session.close()
 
     async def tg_delete_messages(self, chat_id, limit=None):
-        client = TelegramClient(session_file, api_id, api_hash)
-        await client.start(phone=phone_number)
         try:
+            client = await self.get_user_client()
             peer = await client.get_input_entity(chat_id)
+            batch = []
             async for message in client.iter_messages(peer, limit=limit):
-                try:
-                    await client.delete_messages(chat_id, message.id)
-                    logger.info(f"Удалено сообщение с ID {message.id} из чата {chat_id}")
-                except Exception as e:
-                    logger.error(f"Не удалось удалить сообщение с ID {message.id}: {e}")
+                batch.append(message.id)
+                if len(batch) >= DELETE_BATCH_SIZE:
+                    await self._delete_batch(client, peer, chat_id, batch)
+                    batch = []
+            if batch:
+                await self._delete_batch(client, peer, chat_id, batch)
         except Exception as e:
             logger.error(f"Ошибка при получении истории сообщений: {e}")
-        finally:
-            await client.disconnect()
 
     async def tg_delete_messages_by_id(self, chat_id, message_ids):
-        client = TelegramClient(session_file, api_id, api_hash)
-        await client.start(phone=phone_number)
         try:
+            client = await self.get_user_client()
             peer = await client.get_input_entity(chat_id)
-            for message_id in message_ids:
-                try:
-                    await client.delete_messages(peer, message_id)
-                    logger.info(f"Удалено сообщение с ID {message_id} из чата {chat_id}")
-                except Exception as e:
-                    logger.error(f"Не удалось удалить сообщение с ID {message_id}: {e}")
+            message_ids = [message_id for message_id in message_ids if message_id is not None]
+            for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+                await self._delete_batch(client, peer, chat_id, message_ids[start:start + DELETE_BATCH_SIZE])
         except Exception as e:
             logger.error(f"Ошибка при получении истории сообщений: {e}")
-        finally:
-            await client.disconnect()
+
+    @staticmethod
+    async def _delete_batch(client, peer, chat_id, message_ids):
+        try:
+            await client.delete_messages(peer, message_ids)
+            logger.info(f"Удалено {len(message_ids)} сообщений из чата {chat_id}")
+        except Exception as e:
+            logger.error(f"Не удалось удалить сообщения с ID {message_ids}: {e}")
 
 
-telegram_bot = TelegramBot(api_token, CHANNEL_INFO, CHANNEL_WARNING)
+telegram_bot = TelegramBot(api_token, CHANNEL_INFO, CHANNEL_WARNING, api_server=api_server)
+metrics.gauge('telegram_queue_depth', 'Tasks waiting in the Telegram dispatcher',
+              lambda: telegram_bot.message_queue.qsize())
 
 
 # Example usage
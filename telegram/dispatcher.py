@@ -0,0 +1,198 @@
+import time
+import asyncio
+from collections import deque
+from itertools import count
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from logger import logger
+
+# Ограничения Telegram Bot API: около 30 сообщений в секунду на бота
+# и не больше 20 сообщений в минуту в одну группу или канал
+GLOBAL_RATE = 30
+GLOBAL_CAPACITY = 30
+CHAT_RATE = 20 / 60
+CHAT_CAPACITY = 3
+RETRY_LIMIT = 3
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: Скорость пополнения, токенов в секунду
+        :param capacity: Максимальное количество токенов (размер пачки)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class QueueEntry:
+    __slots__ = ('task', 'futures', 'attempts')
+
+    def __init__(self, task, future: asyncio.Future):
+        self.task = task
+        self.futures: List[asyncio.Future] = [future]
+        self.attempts = 0
+
+    def resolve(self, result: Any) -> None:
+        for future in self.futures:
+            if not future.done():
+                future.set_result(result)
+
+
+class ChatQueue:
+    """
+    Очередь задач одного чата.
+
+    Редактирования одного message_id схлопываются: в очереди остается одна
+    задача на своем месте, но с текстом последнего редактирования.
+    """
+
+    def __init__(self):
+        self._order: Deque[Hashable] = deque()
+        self._entries: Dict[Hashable, QueueEntry] = {}
+        self._counter = count()
+        self._not_empty = asyncio.Event()
+        self.paused_until = 0.0
+
+    def put(self, task, future: asyncio.Future) -> None:
+        if task.type == 'edit':
+            key = ('edit', task.message_id)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.task = task
+                entry.futures.append(future)
+                return
+        else:
+            key = (task.type, next(self._counter))
+        self._entries[key] = QueueEntry(task, future)
+        self._order.append(key)
+        self._not_empty.set()
+
+    def put_front(self, entry: QueueEntry) -> None:
+        """
+        Возвращает задачу в начало очереди для повтора.
+
+        Редактирование повторяется под обычным ключом, чтобы с ним схлопывались
+        новые правки. Если новее правка того же сообщения уже ждет в очереди,
+        устаревший текст не отправляется: ожидающие получают ее результат.
+        """
+        if entry.task.type == 'edit':
+            key = ('edit', entry.task.message_id)
+            newer = self._entries.get(key)
+            if newer is not None:
+                newer.futures.extend(entry.futures)
+                self._order.remove(key)
+                entry = newer
+        else:
+            key = ('retry', next(self._counter))
+        self._entries[key] = entry
+        self._order.appendleft(key)
+        self._not_empty.set()
+
+    async def get(self) -> QueueEntry:
+        while not self._order:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self._entries.pop(self._order.popleft())
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+class MessageDispatcher:
+    """
+    Отправка задач в Telegram с отдельной очередью и воркером на каждый чат.
+
+    Каждый чат ограничен своим token bucket, все вместе - общим. Чаты
+    обрабатываются параллельно, поэтому очередь редактирований сводки не
+    задерживает предупреждения. TelegramRetryAfter приостанавливает только
+    тот чат, к которому относится.
+    """
+
+    def __init__(self,
+                 execute: Callable[[Any], Awaitable[Any]],
+                 global_rate=GLOBAL_RATE,
+                 global_capacity=GLOBAL_CAPACITY,
+                 chat_rate=CHAT_RATE,
+                 chat_capacity=CHAT_CAPACITY):
+        """
+        :param execute: Корутина, выполняющая одну задачу; может выбросить TelegramRetryAfter
+        :param global_rate: Сообщений в секунду на бота
+        :param chat_rate: Сообщений в секунду на один чат
+        """
+        self.execute = execute
+        self.chat_rate = chat_rate
+        self.chat_capacity = chat_capacity
+        self.global_bucket = TokenBucket(global_rate, global_capacity)
+        self._queues: Dict[int, ChatQueue] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def put(self, task) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._get_queue(task.chat_id).put(task, future)
+        return future
+
+    def qsize(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _get_queue(self, chat_id: int) -> ChatQueue:
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = ChatQueue()
+            self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_capacity)
+            self._workers[chat_id] = asyncio.create_task(self._worker(chat_id))
+        return queue
+
+    async def _worker(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        bucket = self._buckets[chat_id]
+        while True:
+            entry = await queue.get()
+            pause = queue.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if entry.task.type != 'delete':
+                # Удаление идет через Telethon и не расходует лимиты бота
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+            try:
+                result = await self.execute(entry.task)
+            except TelegramRetryAfter as e:
+                logger.warning(f"Rate limit exceeded in chat {chat_id}. Pausing it for {e.retry_after} seconds.")
+                queue.paused_until = time.monotonic() + e.retry_after + 1
+                queue.put_front(entry)
+                continue
+            except Exception as e:
+                entry.attempts += 1
+                if entry.attempts < RETRY_LIMIT:
+                    logger.error(f"Telegram task {entry.task.type} in chat {chat_id} failed, retrying: {e}")
+                    queue.put_front(entry)
+                else:
+                    logger.error(f"Telegram task {entry.task.type} in chat {chat_id} failed: {e}")
+                    entry.resolve(None)
+                continue
+            entry.resolve(result)
+
+    async def close(self) -> None:
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+
+import numpy as np
+import pytest
+
+from calculate import (CycleResults, HistoryBuffer, RuleContext, compile_rules, evaluate_batch,
+                       load_event_results, load_rules, replay)
+from database import SQLiteStore
+
+
+def make_cycles(samples):
+    return [(f"2026-01-01T00:{minute:02d}:00", [('site', with_tickets, total)])
+            for minute, (with_tickets, total) in enumerate(samples)]
+
+
+@pytest.mark.parametrize('checks', [1, 3, 6])
+def test_sustained_zero_fires_once_on_unchanged_zeros(checks):
+    rules = compile_rules([{'name': 'sold_out', 'type': 'sustained_zero', 'checks': checks}])
+    report = replay(make_cycles([(5, 10)] + [(0, 10)] * 6), rules=rules)
+    assert report.counts() == {'sold_out': 1}
+    assert report.alerts[0].time == f"2026-01-01T00:{checks:02d}:00"
+
+
+def test_changed_only_rules_ignore_unchanged_samples():
+    rules = compile_rules([
+        {'name': 'drop', 'type': 'drop_over_window', 'drop': 10, 'below': 9},
+        {'name': 'sold_out', 'type': 'sustained_zero', 'checks': 3},
+    ])
+    # Падение до 5% при последней проверке с билетами срабатывает один раз, повторы ответа - нет
+    report = replay(make_cycles([(6, 10)] * 5 + [(1, 20)] * 4), rules=rules)
+    assert report.counts() == {'drop': 1}
+
+
+def test_load_rules_requires_existing_explicit_path(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_rules(str(tmp_path / 'typo.json'))
+    assert [rule.name for rule in load_rules().rules] == ['drop', 'reappearance']
+
+
+def test_unchanged_checks_are_stored_as_repeats(tmp_path):
+    database = str(tmp_path / 'events.db')
+
+    async def run():
+        store = SQLiteStore(database=database)
+        await store.init_db()
+        for changed in (True, False, False, True, False):
+            cycle = CycleResults()
+            cycle.append('site', 10, 0, 10, changed=changed)
+            await store.save_results(cycle)
+        # Ответ не изменился, но последняя строка сайта с другими значениями - нужна новая строка
+        cycle = CycleResults()
+        cycle.append('site', 20, 5, 15, changed=False)
+        await store.save_results(cycle)
+        history = await store.load_history(['site'], limit=4)
+        await store.close()
+        return history
+
+    assert asyncio.run(run()) == {'site': [(5, 20), (0, 10), (0, 10), (0, 10)]}
+    with sqlite3.connect(database) as connection:
+        assert connection.execute('SELECT repeat_count FROM event_results ORDER BY id').fetchall() == [(2,), (1,), (0,)]
+    cycles = list(load_event_results(database))
+    assert [samples for _, samples in cycles] == [[('site', 0, 10)]] * 5 + [[('site', 5, 20)]]
+
+
+def test_below_baseline_skips_sites_without_rollups():
+    rules = compile_rules([{'name': 'below_usual', 'type': 'below_baseline', 'drop': 20}])
+    history = HistoryBuffer(window=3)
+    rows = history.rows(['low', 'usual', 'new'])
+    history.set_baselines(['low', 'usual'], [50.0, 15.0])
+    evaluation = evaluate_batch(np.array([1, 1, 1]), np.array([10, 10, 10]), *history.history(rows),
+                                baselines=history.baselines[rows])
+    fired = rules.evaluate(['low', 'usual', 'new'], RuleContext(evaluation, *history.history(rows)), now=0)
+    assert [alert.site_name for alert in fired] == ['low']